@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+
+def normalize_prompt(prompt: str) -> str:
+    """规范化提示词：统一 Unicode 形式，去掉行首尾空白和多余空行，避免无意义差异导致缓存失效"""
+    prompt = unicodedata.normalize("NFC", prompt)
+    lines = [line.strip() for line in prompt.strip().splitlines()]
+    normalized = []
+    for line in lines:
+        if line or (normalized and normalized[-1]):
+            normalized.append(line)
+    return "\n".join(normalized)
+
+
+def make_cache_key(model: str, options: Dict[str, Any], prompt: str) -> str:
+    """以 (模型, 推理参数, 规范化提示词) 的哈希作为内容地址"""
+    material = json.dumps(
+        {"model": model, "options": options, "prompt": normalize_prompt(prompt)},
+        ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """持久化的 Ollama 分析结果缓存
+
+    存放在 SQLite（WAL 模式）中，多个 worker 进程可以安全地并发读写；
+    条目超过 ttl 秒后失效，总大小超过 max_bytes 时按最近访问时间淘汰。
+    方法均为同步调用，在事件循环中请通过 asyncio.to_thread 使用。
+    """
+
+    def __init__(self, path: str, ttl: float, max_bytes: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    analysis TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_accessed ON analysis_cache(accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """返回 {"analysis", "created_at"}，不存在或已过期时返回 None"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT analysis, created_at FROM analysis_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE analysis_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        finally:
+            conn.close()
+        self.hits += 1
+        return {"analysis": row[0], "created_at": row[1]}
+
+    def put(self, key: str, model: str, analysis: str):
+        now = time.time()
+        size = len(analysis.encode("utf-8")) + len(key)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, model, analysis, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, analysis, size, now, now)
+            )
+            self._prune(conn, now)
+        finally:
+            conn.close()
+
+    def _prune(self, conn: sqlite3.Connection, now: float):
+        """删除过期条目，再按最近访问时间从旧到新淘汰，直到总大小不超过上限"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM analysis_cache WHERE created_at <= ?", (now - self.ttl,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_cache").fetchone()[0]
+            if total > self.max_bytes:
+                for key, size in conn.execute(
+                        "SELECT key, size FROM analysis_cache ORDER BY accessed_at").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                    total -= size
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        try:
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis_cache"
+            ).fetchone()
+        finally:
+            conn.close()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        }
@@ -1,13 +1,35 @@
-import requests
+import httpx
+import asyncio
 import json
-from typing import List, Dict
+from dataclasses import dataclass, field, replace
+from typing import List, Dict, Optional, Tuple, Union
 import time
 import os
+import random
 import argparse
 import sys
+from contextlib import nullcontext
+
+from ttl_cache import TTLCache
+from analysis_cache import AnalysisCache, make_cache_key
+from result_store import ResultStore
+from model_catalog import ModelCatalog
+from snapshots import SnapshotStore, diff_counts, diff_topics
+from trend_index import TrendIndex
+from clustering import cluster_topics
+from circuit_breaker import BreakerRegistry, CircuitBreaker, CircuitOpenError
+import metrics
+import prompts
+from prompts import Prompt
 
 sys.stdout.reconfigure(line_buffering=True)
 
+DEFAULT_PLATFORMS = [
+    "weibo", "zhihu", "baidu", "bilibili", "douyin",
+    "toutiao", "36kr", "ithome", "github", "hackernews"
+]
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="网络热搜分析工具 - 可配置化版本 (Powered by Ollama)"
@@ -25,10 +47,8 @@ def parse_args():
     parser.add_argument("--save-dir", type=str, default=os.path.expanduser("~/hot_trends_analysis/outputs"),
                         help="结果保存目录")
 
-    parser.add_argument("--platforms", type=str, nargs="+", default=[
-        "weibo", "zhihu", "baidu", "bilibili", "douyin",
-        "toutiao", "36kr", "ithome", "github", "hackernews"
-    ], help="要分析的平台列表（空格分隔）")
+    parser.add_argument("--platforms", type=str, nargs="+", default=DEFAULT_PLATFORMS,
+                        help="要分析的平台列表（空格分隔）")
 
     parser.add_argument("--topics-per-platform", type=int, default=10,
                         help="每个平台提取的热搜条数")
@@ -37,32 +57,238 @@ def parse_args():
                         help="最大重试次数")
 
     parser.add_argument("--retry-delay", type=float, default=5,
-                        help="重试等待时间（秒）")
+                        help="重试退避基准时间（秒），实际等待按指数退避加随机抖动计算")
+
+    parser.add_argument("--fetch-concurrency", type=int, default=5,
+                        help="同时获取热搜的平台数上限")
+
+    parser.add_argument("--platform-timeout", type=float, default=20,
+                        help="单个平台（含重试）的获取时限（秒）")
+
+    parser.add_argument("--collect-timeout", type=float, default=45,
+                        help="热搜收集阶段的总时限（秒），超时后使用已返回的平台继续分析")
+
+    parser.add_argument("--temperature", type=float, default=0.7,
+                        help="生成温度")
+
+    parser.add_argument("--num-predict", type=int, default=prompts.REPORT_NUM_PREDICT,
+                        help="报告的最大输出 token 数")
+
+    parser.add_argument("--max-ctx", type=int, default=32768,
+                        help="上下文窗口上限，实际 num_ctx 按提示词长度在此范围内自动选择")
+
+    parser.add_argument("--no-dedupe", dest="dedupe", action="store_false",
+                        help="不对跨平台的相似标题做聚类去重")
+
+    parser.add_argument("--cluster-threshold", type=float, default=0.6,
+                        help="标题聚类的字符二元组 Dice 相似度阈值（0-1）")
+
+    parser.add_argument("--mode", dest="analysis_mode", choices=["single", "map_reduce"], default="single",
+                        help="分析模式：single 单次调用；map_reduce 先分平台概括再汇总")
+
+    parser.add_argument("--map-batch-size", type=int, default=1,
+                        help="map_reduce 模式下每个摘要批次包含的平台数")
+
+    parser.add_argument("--map-concurrency", type=int, default=2,
+                        help="map_reduce 模式下同时进行的摘要调用数")
+
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="整次运行的时限（秒），到时模型仍未完成则输出部分报告")
 
     return parser.parse_args()
 
 
-def fetch_hot_search(platform: str, api_url: str, max_retries: int, retry_delay: float) -> Dict:
-    """获取指定平台的热搜数据，失败后自动重试"""
-    for attempt in range(1, max_retries + 1):
-        try:
-            url = f"{api_url}/{platform}"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            if attempt < max_retries:
-                print(f"⚠️  获取 {platform} 数据失败 (尝试 {attempt}/{max_retries}): {e}", flush=True)
-                print(f"   等待 {retry_delay} 秒后重试...", flush=True)
-                time.sleep(retry_delay)
+@dataclass
+class AnalysisConfig:
+    """一次分析运行的全部参数，字段与命令行参数一一对应"""
+    hot_search_api: str
+    ollama_api: str
+    ollama_model: str = "qwen2.5:14b"
+    save_dir: str = os.path.expanduser("~/hot_trends_analysis/outputs")
+    platforms: List[str] = field(default_factory=lambda: list(DEFAULT_PLATFORMS))
+    topics_per_platform: int = 10
+    max_retries: int = 5
+    retry_delay: float = 5
+    # 推理参数：num_ctx 按提示词估算长度在不超过 max_ctx 的几档之间选择
+    temperature: float = 0.7
+    num_predict: int = prompts.REPORT_NUM_PREDICT
+    max_ctx: int = 32768
+    fetch_concurrency: int = 5
+    platform_timeout: float = 20
+    collect_timeout: float = 45
+    # 分析模式：single 为单次调用；map_reduce 先并发概括各平台批次，再汇总成报告
+    analysis_mode: str = "single"
+    map_batch_size: int = 1
+    map_concurrency: int = 2
+    # 构建提示词前对跨平台的近似重复标题聚类，共同热点只出现一次并标注来源
+    dedupe: bool = True
+    cluster_threshold: float = 0.6
+    # 跨运行共享的热搜缓存，为 None 时每次都请求上游（命令行模式）
+    hot_cache: Optional[TTLCache] = None
+    # 持久化的模型分析缓存，为 None 时总是调用 Ollama
+    analysis_cache: Optional[AnalysisCache] = None
+    # 结果存储与本次运行 ID；未配置时按时间戳写入 save_dir（命令行模式）
+    result_store: Optional[ResultStore] = None
+    run_id: Optional[str] = None
+    # 共享的模型目录：模型检查走缓存，缺失的模型在后台拉取；为 None 时同步检查并拉取（命令行模式）
+    model_catalog: Optional[ModelCatalog] = None
+    # 传给 Ollama 的 keep_alive，控制模型在两次调用之间的常驻时长
+    keep_alive: Optional[Union[str, float]] = None
+    # 热搜快照与增量分析基线；为 None 时不保存快照，incremental 模式退化为完整分析
+    snapshot_store: Optional[SnapshotStore] = None
+    # 增量分析的适用条件：上一期报告的最长时效、最多连续增量次数、新上榜条目占比上限
+    incremental_max_age: float = 3600
+    incremental_max_chain: int = 5
+    incremental_max_change: float = 0.5
+    # 热搜历史索引：每次从上游获取到的榜单都写入，为 None 时不记录
+    trend_index: Optional[TrendIndex] = None
+    # 多模型对比：非空时共用一次数据收集和同一份提示词，按 model_concurrency 并发调用各模型；
+    # fanout_policy 为 first 时以最先成功的模型作为结果，并取消其余模型
+    compare_models: List[str] = field(default_factory=list)
+    model_concurrency: int = 2
+    fanout_policy: str = "all"
+    # 各上游（platform:<平台>、ollama）的熔断器，为 None 时不熔断（命令行模式）
+    breakers: Optional[BreakerRegistry] = None
+    # 整次运行的时限（秒），为 None 时不限；到时模型仍未完成的分析以部分报告结束
+    deadline: Optional[float] = None
+
+
+class AnalysisError(Exception):
+    """分析流程无法继续时抛出，message 即展示给用户的错误信息"""
+
+
+class RunLogger:
+    """运行日志：有事件队列时推送 log 事件，否则直接打印到标准输出（命令行模式）"""
+
+    def __init__(self, queue: Optional[asyncio.Queue] = None, stream_tokens: bool = True,
+                 label: Optional[str] = None, transcript: Optional[List[str]] = None):
+        self.queue = queue
+        self.stream_tokens = stream_tokens
+        self.label = label
+        # 记录推送过的 token，运行超时时用已生成的部分文本组成部分报告
+        self.transcript = transcript
+
+    def recording(self, transcript: List[str]) -> "RunLogger":
+        """返回把 token 同时记录到 transcript 的日志器（带标签和不推送 token 的派生日志器不记录到这里）"""
+        return RunLogger(self.queue, self.stream_tokens, label=self.label, transcript=transcript)
+
+    def without_tokens(self) -> "RunLogger":
+        """返回共用同一队列、但不推送 token 事件的日志器（用于不面向用户的中间调用）"""
+        return RunLogger(self.queue, stream_tokens=False, label=self.label)
+
+    def labelled(self, label: str, transcript: Optional[List[str]] = None) -> "RunLogger":
+        """返回带标签的日志器：日志行加上 [label] 前缀，token 事件带 model 字段（多模型对比时区分来源）
+
+        指定 transcript 时把该模型的 token 单独记录下来。
+        """
+        return RunLogger(self.queue, self.stream_tokens, label=label, transcript=transcript)
+
+    def __call__(self, message: str = ""):
+        # 与原先逐行读取子进程输出的行为保持一致：每一行一个事件
+        for line in message.split("\n"):
+            if self.label is not None:
+                line = f"[{self.label}] {line}"
+            if self.queue is None:
+                print(line, flush=True)
             else:
-                print(f"❌ 获取 {platform} 数据失败，已重试 {max_retries} 次: {e}", flush=True)
+                self.queue.put_nowait({"type": "log", "message": line})
+
+    def event(self, event: Dict):
+        """推送其他类型的事件，命令行模式下忽略"""
+        if self.queue is not None:
+            self.queue.put_nowait(event)
+
+    def token(self, content: str, reset: bool = False):
+        """推送模型生成的增量文本；reset 表示此前推送的文本作废（重试时重新生成）。命令行模式下不输出"""
+        if not self.stream_tokens:
+            return
+        if self.transcript is not None:
+            if reset:
+                self.transcript.clear()
+            self.transcript.append(content)
+        if self.queue is None:
+            return
+        event = {"type": "token", "content": content}
+        if reset:
+            event["reset"] = True
+        if self.label is not None:
+            event["model"] = self.label
+        self.queue.put_nowait(event)
+
+
+# 进程内共享的 HTTP 客户端，复用到 DailyHotApi / Ollama 的 keep-alive 连接
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的 HTTP 客户端，首次调用（或事件循环变化）时创建连接池"""
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60)
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+async def close_http_client():
+    """关闭共享的 HTTP 客户端"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def get_breaker(config: AnalysisConfig, name: str) -> Optional[CircuitBreaker]:
+    return config.breakers.get(name) if config.breakers is not None else None
+
+
+def backoff_delay(attempt: int, base: float, cap: float = 30) -> float:
+    """指数退避 + 全抖动：在 [0, min(cap, base * 2^(attempt-1))] 内随机取值"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def fetch_hot_search(client: httpx.AsyncClient, platform: str, api_url: str,
+                           max_retries: int, retry_delay: float, log: RunLogger,
+                           breaker: Optional[CircuitBreaker] = None) -> Optional[Dict]:
+    """获取指定平台的热搜数据，失败后自动重试；熔断器打开时直接跳过，不再重试"""
+    with metrics.span("fetch", platform=platform, retries=0) as span:
+        for attempt in range(1, max_retries + 1):
+            try:
+                url = f"{api_url}/{platform}"
+                with breaker.call() if breaker is not None else nullcontext():
+                    response = await client.get(url, timeout=10)
+                    response.raise_for_status()
+                    data = response.json()
+                span.set(ok=True)
+                return data
+            except CircuitOpenError as e:
+                span.set(ok=False, circuit="open")
+                log(f"⛔ 跳过 {platform}: {e}")
                 return None
+            except Exception as e:
+                if attempt < max_retries and not (breaker is not None and breaker.state == "open"):
+                    delay = backoff_delay(attempt, retry_delay)
+                    span.set(retries=attempt)
+                    metrics.FETCH_RETRIES.inc(platform=platform)
+                    log(f"⚠️  获取 {platform} 数据失败 (尝试 {attempt}/{max_retries}): {e}")
+                    log(f"   等待 {delay:.1f} 秒后重试...")
+                    await asyncio.sleep(delay)
+                else:
+                    span.set(ok=False)
+                    if attempt < max_retries:
+                        log(f"❌ 获取 {platform} 数据失败，连续失败过多已熔断: {e}")
+                    else:
+                        log(f"❌ 获取 {platform} 数据失败，已重试 {max_retries} 次: {e}")
+                    return None
     return None
 
 
-def extract_hot_topics(data: Dict, platform: str, topics_per_platform: int) -> List[str]:
-    """从API返回的数据中提取热搜标题"""
+def extract_hot_topics(data: Dict, platform: str, topics_per_platform: Optional[int],
+                       log: RunLogger) -> List[str]:
+    """从API返回的数据中提取热搜标题，topics_per_platform 为 None 时提取全部"""
     topics = []
     try:
         if data and "data" in data:
@@ -72,213 +298,649 @@ def extract_hot_topics(data: Dict, platform: str, topics_per_platform: int) -> L
                 if title:
                     topics.append(title)
     except Exception as e:
-        print(f"⚠️  解析 {platform} 数据时出错: {e}", flush=True)
+        log(f"⚠️  解析 {platform} 数据时出错: {e}")
     return topics
 
 
-def call_ollama(prompt: str, ollama_api: str, model_name: str,
-                max_retries: int, retry_delay: float) -> str:
-    """调用本地Ollama进行分析，失败后自动重试"""
+async def collect_hot_topics(client: httpx.AsyncClient, config: AnalysisConfig,
+                             log: RunLogger) -> Tuple[Dict[str, List[str]], Dict[str, Dict], Dict[str, Dict]]:
+    """并发获取各平台热搜：受并发上限约束，单平台与整体均有时限，超时则使用已返回的平台
+
+    返回 (各平台热搜, 各平台数据新鲜度, 各平台快照)；配置了 hot_cache 时优先使用缓存，
+    配置了 snapshot_store 时保存完整榜单的快照，快照项为 SnapshotStore.record 的返回值。
+    """
+    if not config.platforms:
+        return {}, {}, {}
+    semaphore = asyncio.Semaphore(max(1, config.fetch_concurrency))
+    freshness = {}
+    snapshots = {}
+
+    async def load(platform: str, log: RunLogger) -> Optional[List[str]]:
+        # 缓存中保存完整的标题列表，由各次运行按 topics_per_platform 截取
+        async with semaphore:
+            log(f"📡 正在获取 {platform} 热搜...")
+            try:
+                data = await asyncio.wait_for(
+                    fetch_hot_search(client, platform, config.hot_search_api,
+                                     config.max_retries, config.retry_delay, log,
+                                     breaker=get_breaker(config, f"platform:{platform}")),
+                    timeout=config.platform_timeout
+                )
+            except asyncio.TimeoutError:
+                log(f"⏱️  {platform}: 超过 {config.platform_timeout} 秒未完成，已跳过")
+                return None
+
+        if not data:
+            return None
+        with metrics.span("extract", platform=platform):
+            titles = extract_hot_topics(data, platform, None, log)
+        if not titles:
+            log(f"⚠️  {platform}: 未能提取到热搜内容")
+            return None
+        if config.trend_index is not None:
+            # 只在真正请求上游时写入，缓存命中不会产生重复观测
+            try:
+                await asyncio.to_thread(config.trend_index.ingest, platform, titles)
+            except Exception as e:
+                log(f"⚠️  {platform}: 写入历史索引失败: {e}")
+        return titles
+
+    async def fetch_one(platform: str) -> List[str]:
+        if config.hot_cache is None:
+            titles = await load(platform, log)
+            freshness[platform] = {"cache": "disabled", "age_seconds": 0}
+        else:
+            # 后台刷新可能在本次运行结束后才完成，日志输出到标准输出而不是本次运行
+            cached = await config.hot_cache.get((config.hot_search_api, platform), lambda: load(platform, log),
+                                                refresh=lambda: load(platform, RunLogger().labelled("后台刷新")))
+            titles = cached.value
+            freshness[platform] = {"cache": cached.status, "age_seconds": round(cached.age, 1)}
+            metrics.CACHE_LOOKUPS.inc(cache="hot_search", result=cached.status)
+            if titles and cached.status != "miss":
+                log(f"♻️  {platform}: 使用 {cached.age:.0f} 秒前缓存的热搜")
+
+        if not titles:
+            return []
+        if config.snapshot_store is not None:
+            snapshots[platform] = await asyncio.to_thread(config.snapshot_store.record, platform, titles)
+        topics = titles[:config.topics_per_platform]
+        log(f"✅ {platform}: 获取到 {len(topics)} 条热搜")
+        return topics
+
+    tasks = {platform: asyncio.create_task(fetch_one(platform)) for platform in config.platforms}
+    _, pending = await asyncio.wait(tasks.values(), timeout=config.collect_timeout)
+
+    if pending:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        skipped = [platform for platform, task in tasks.items() if task in pending]
+        log(f"⏱️  收集阶段超过 {config.collect_timeout} 秒，跳过未返回的平台: {', '.join(skipped)}")
+
+    # 按请求中的平台顺序组织结果
+    all_topics = {}
+    for platform, task in tasks.items():
+        if task.cancelled() or task.exception() is not None:
+            continue
+        topics = task.result()
+        if topics:
+            all_topics[platform] = topics
+    return (all_topics, {platform: freshness[platform] for platform in all_topics},
+            {platform: snapshots[platform] for platform in all_topics if platform in snapshots})
+
+
+async def call_ollama(client: httpx.AsyncClient, prompt: Prompt, ollama_api: str, model_name: str,
+                      options: Dict, max_retries: int, retry_delay: float,
+                      log: RunLogger, keep_alive: Optional[Union[str, float]] = None,
+                      breaker: Optional[CircuitBreaker] = None) -> Tuple[str, Dict]:
+    """以流式方式调用本地Ollama进行分析，失败后自动重试；熔断器打开时立即放弃
+
+    生成过程中逐段推送 token 事件，返回 (完整文本, 生成耗时统计)。
+    """
     for attempt in range(1, max_retries + 1):
+        parts = []
         try:
             payload = {
                 "model": model_name,
-                "messages": [{"role": "user", "content": prompt}],
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "num_predict": 2000,
-                    "num_ctx": 32768
-                }
+                "messages": prompt.messages(),
+                "stream": True,
+                "options": options
             }
+            if keep_alive is not None:
+                payload["keep_alive"] = keep_alive
 
             chat_api = f"{ollama_api}/api/chat"
             if attempt == 1:
-                print(f" 调用 Ollama API: {chat_api}", flush=True)
-                print(f" 上下文窗口: {payload['options']['num_ctx']} tokens", flush=True)
-
-            response = requests.post(chat_api, json=payload, timeout=300)
-            response.raise_for_status()
-            result = response.json()
-
-            if "message" in result and "content" in result["message"]:
-                return result["message"]["content"]
-            return ""
+                log(f" 调用 Ollama API: {chat_api}")
+                log(f" 上下文窗口: {payload['options']['num_ctx']} tokens")
+
+            started = time.perf_counter()
+            first_token_at = None
+            final = {}
+            with breaker.call() if breaker is not None else nullcontext():
+                async with client.stream("POST", chat_api, json=payload,
+                                         timeout=httpx.Timeout(300, connect=10)) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if "error" in chunk:
+                            raise RuntimeError(chunk["error"])
+                        content = chunk.get("message", {}).get("content", "")
+                        if content:
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                            parts.append(content)
+                            log.token(content)
+                        if chunk.get("done"):
+                            final = chunk
+                            break
+
+            return "".join(parts), generation_stats(started, first_token_at, len(parts), final)
+        except CircuitOpenError as e:
+            log(f"⛔ 放弃调用 Ollama: {e}")
+            return "", {}
         except Exception as e:
+            if parts:
+                log.token("", reset=True)
+            if breaker is not None and breaker.state == "open":
+                log(f"❌ Ollama 调用失败，连续失败过多已熔断: {e}")
+                return "", {}
             if attempt < max_retries:
-                print(f"⚠️  Ollama 调用失败 (尝试 {attempt}/{max_retries}): {e}", flush=True)
-                print(f"   等待 {retry_delay} 秒后重试...", flush=True)
-                time.sleep(retry_delay)
+                delay = backoff_delay(attempt, retry_delay)
+                log(f"⚠️  Ollama 调用失败 (尝试 {attempt}/{max_retries}): {e}")
+                log(f"   等待 {delay:.1f} 秒后重试...")
+                await asyncio.sleep(delay)
             else:
-                print(f"❌ Ollama 调用失败，已重试 {max_retries} 次: {e}", flush=True)
-                return ""
-    return ""
-
-
-def ensure_ollama_model(ollama_api: str, model_name: str) -> bool:
+                log(f"❌ Ollama 调用失败，已重试 {max_retries} 次: {e}")
+                return "", {}
+    return "", {}
+
+
+def generation_stats(started: float, first_token_at: Optional[float], chunks: int, final: Dict) -> Dict:
+    """根据本地计时和 Ollama 结束帧中的统计字段计算首 token 时延与生成速度"""
+    finished = time.perf_counter()
+    eval_count = final.get("eval_count") or chunks
+    # eval_duration 为纳秒；缺失时用首 token 之后的本地耗时估算
+    eval_seconds = final.get("eval_duration", 0) / 1e9
+    if not eval_seconds and first_token_at is not None:
+        eval_seconds = finished - first_token_at
+    return {
+        "time_to_first_token": round(first_token_at - started, 3) if first_token_at else None,
+        "total_time": round(finished - started, 3),
+        "prompt_tokens": final.get("prompt_eval_count"),
+        "completion_tokens": eval_count,
+        "tokens_per_second": round(eval_count / eval_seconds, 2) if eval_seconds > 0 else None
+    }
+
+
+async def ensure_ollama_model(client: httpx.AsyncClient, ollama_api: str, model_name: str,
+                              log: RunLogger) -> bool:
     """检查模型是否存在，不存在则自动拉取"""
     try:
-        response = requests.get(f"{ollama_api}/api/tags", timeout=10)
+        response = await client.get(f"{ollama_api}/api/tags", timeout=10)
         response.raise_for_status()
         models = response.json().get("models", [])
         model_names = [m["name"] for m in models]
 
         if model_name in model_names:
-            print(f"✅ 模型已存在: {model_name}", flush=True)
+            log(f"✅ 模型已存在: {model_name}")
             return True
 
-        print(f"📦 模型不存在，正在拉取: {model_name} ...", flush=True)
-        pull_response = requests.post(f"{ollama_api}/api/pull", json={"name": model_name}, stream=True, timeout=600)
-
-        for line in pull_response.iter_lines():
-            if line:
-                try:
-                    msg = json.loads(line.decode('utf-8'))
-                    status = msg.get("status")
-                    if status:
-                        print(f"   {status}", flush=True)
-                except json.JSONDecodeError:
-                    pass
-
-        print(f"✅ 模型拉取完成: {model_name}", flush=True)
+        log(f"📦 模型不存在，正在拉取: {model_name} ...")
+        async with client.stream("POST", f"{ollama_api}/api/pull", json={"name": model_name},
+                                 timeout=600) as pull_response:
+            async for line in pull_response.aiter_lines():
+                if line:
+                    try:
+                        msg = json.loads(line)
+                        status = msg.get("status")
+                        if status:
+                            log(f"   {status}")
+                    except json.JSONDecodeError:
+                        pass
+
+        log(f"✅ 模型拉取完成: {model_name}")
         return True
     except Exception as e:
-        print(f"❌ 检查/拉取模型时出错: {e}", flush=True)
+        log(f"❌ 检查/拉取模型时出错: {e}")
         return False
 
 
-def analyze_hot_trends(args):
-    """主函数：分析网络热门趋势"""
-    print("🚀 开始收集热搜数据...\n", flush=True)
-
-    if not ensure_ollama_model(args.ollama_api, args.ollama_model):
-        print("❌ 无法准备 Ollama 模型，终止分析。", flush=True)
-        return
-
-    all_topics = {}
-
-    for platform in args.platforms:
-        print(f"📡 正在获取 {platform} 热搜...", flush=True)
-        data = fetch_hot_search(platform, args.hot_search_api, args.max_retries, args.retry_delay)
-
-        if data:
-            topics = extract_hot_topics(data, platform, args.topics_per_platform)
-            if topics:
-                all_topics[platform] = topics
-                print(f"✅ {platform}: 获取到 {len(topics)} 条热搜", flush=True)
+async def prepare_model(client: httpx.AsyncClient, config: AnalysisConfig, model_name: str,
+                        log: RunLogger) -> bool:
+    """确认模型可用：有模型目录时走缓存并在后台拉取缺失的模型，否则同步检查并拉取"""
+    if config.model_catalog is not None:
+        return await config.model_catalog.ensure(client, model_name, log)
+    return await ensure_ollama_model(client, config.ollama_api, model_name, log)
+
+
+async def generate(client: httpx.AsyncClient, config: AnalysisConfig, prompt: Prompt, options: Dict,
+                   log: RunLogger) -> Tuple[str, bool, Dict]:
+    """带分析缓存的模型调用，返回 (文本, 是否来自缓存, 生成耗时统计)"""
+    cache_key = make_cache_key(config.ollama_model, options, prompt.text())
+    if config.analysis_cache is not None:
+        cached = await asyncio.to_thread(config.analysis_cache.get, cache_key)
+        metrics.CACHE_LOOKUPS.inc(cache="analysis", result="hit" if cached else "miss")
+        if cached:
+            log(f"♻️  命中分析缓存（{time.time() - cached['created_at']:.0f} 秒前生成），跳过 Ollama 调用")
+            log.token(cached["analysis"])
+            return cached["analysis"], True, {}
+
+    with metrics.span("llm", model=config.ollama_model, num_ctx=options["num_ctx"]) as span:
+        text, generation = await call_ollama(client, prompt, config.ollama_api, config.ollama_model,
+                                             options, config.max_retries, config.retry_delay, log,
+                                             keep_alive=config.keep_alive,
+                                             breaker=get_breaker(config, "ollama"))
+        span.set(ok=bool(text), **{k: v for k, v in generation.items() if k != "total_time"})
+    if generation.get("time_to_first_token") is not None:
+        log(f"⚡ 首 token 时延 {generation['time_to_first_token']} 秒，"
+            f"生成速度 {generation['tokens_per_second']} tokens/s")
+    if text and config.analysis_cache is not None:
+        await asyncio.to_thread(config.analysis_cache.put, cache_key, config.ollama_model, text)
+    return text, False, generation
+
+
+async def map_reduce_analysis(client: httpx.AsyncClient, config: AnalysisConfig,
+                              all_topics: Dict[str, List[str]], clusters: Optional[List[Dict]],
+                              log: RunLogger) -> Tuple[str, bool, Dict, Dict]:
+    """两阶段分析：map 阶段并发概括各平台批次，reduce 阶段基于摘要撰写最终报告
+
+    单个批次失败时，汇总阶段改用该批次的原始热搜，不影响整体报告。
+    返回 (报告, 是否全部来自缓存, 汇总阶段生成统计, 阶段信息)。
+    """
+    platforms = list(all_topics.keys())
+    batch_size = max(1, config.map_batch_size)
+    batches = [platforms[i:i + batch_size] for i in range(0, len(platforms), batch_size)]
+    semaphore = asyncio.Semaphore(max(1, config.map_concurrency))
+    map_log = log.without_tokens()
+
+    async def map_one(batch: List[str]) -> Dict:
+        async with semaphore:
+            started = time.perf_counter()
+            with metrics.span("prompt_build", stage="map"):
+                prompt = prompts.build_map_prompt({p: all_topics[p] for p in batch})
+                options = prompts.build_options(prompt, prompts.MAP_NUM_PREDICT_PER_PLATFORM * len(batch),
+                                                prompts.MAP_TEMPERATURE, config.max_ctx)
+            summary, from_cache, generation = await generate(client, config, prompt, options, map_log)
+            elapsed = round(time.perf_counter() - started, 3)
+            if summary:
+                log(f"🗂️  {', '.join(batch)}: 摘要完成（{elapsed} 秒{'，缓存' if from_cache else ''}）")
             else:
-                print(f"⚠️  {platform}: 未能提取到热搜内容", flush=True)
-
-        time.sleep(0.5)
-
-    if not all_topics:
-        print("\n❌ 未能获取到任何热搜数据，请检查API服务是否正常", flush=True)
-        return
-
-    print("\n" + "="*60, flush=True)
-    print("🤖 正在使用 Ollama 分析热搜趋势...", flush=True)
-    print("="*60 + "\n", flush=True)
-
-    topics_text = ""
-    for platform, topics in all_topics.items():
-        topics_text += f"\n【{platform}】\n"
-        for i, topic in enumerate(topics, 1):
-            topics_text += f"{i}. {topic}\n"
-
-    prompt = f"""请阅读以下来自多个平台的热搜数据，写一篇流畅的总结报告，描述当前网络热门趋势。
-
-要求：
-- 用自然流畅的段落形式写作，不要使用分点列表或标题
-- 要将趋势分析和具体事实有机结合，尤其要明确指出信源哪个平台、原始内容是什么
-- 被多个平台提到的内容重点分析
-- 在文末列举出被全网所关注的原始内容
-- 全文控制在300-500字，语言专业但易读
-- 需要注意平台调用名称和站点名的对应关系，在文中要使用站点名称，不能出现调用名称：
-| **站点**         | **类别**     | **调用名称**   |
-| ---------------- | ------------ | -------------- | 
-| 哔哩哔哩         | 热门榜       | bilibili       | 
-| AcFun            | 排行榜       | acfun          | 
-| 微博             | 热搜榜       | weibo          | 
-| 知乎             | 热榜         | zhihu          | 
-| 知乎日报         | 推荐榜       | zhihu-daily    | 
-| 百度             | 热搜榜       | baidu          | 
-| 抖音             | 热点榜       | douyin         | 
-| 快手             | 热点榜       | kuaishou       | 
-| 豆瓣电影         | 新片榜       | douban-movie   | 
-| 豆瓣讨论小组     | 讨论精选     | douban-group   | 
-| 百度贴吧         | 热议榜       | tieba          | 
-| 少数派           | 热榜         | sspai          | 
-| IT之家           | 热榜         | ithome         | 
-| IT之家「喜加一」 | 最新动态     | ithome-xijiayi | 
-| 简书             | 热门推荐     | jianshu        | 
-| 果壳             | 热门文章     | guokr          | 
-| 澎湃新闻         | 热榜         | thepaper       | 
-| 今日头条         | 热榜         | toutiao        | 
-| 36 氪            | 热榜         | 36kr           | 
-| 51CTO            | 推荐榜       | 51cto          | 
-| CSDN             | 排行榜       | csdn           | 
-| NodeSeek         | 最新动态     | nodeseek       | 
-| 稀土掘金         | 热榜         | juejin         | 
-| 腾讯新闻         | 热点榜       | qq-news        | 
-| 新浪网           | 热榜         | sina           | 
-| 新浪新闻         | 热点榜       | sina-news      | 
-| 网易新闻         | 热点榜       | netease-news   | 
-| 吾爱破解         | 榜单         | 52pojie        | 
-| 全球主机交流     | 榜单         | hostloc        | 
-| 虎嗅             | 24小时       | huxiu          | 
-| 酷安             | 热榜         | coolapk        | 
-| 虎扑             | 步行街热帖   | hupu           | 
-| 爱范儿           | 快讯         | ifanr          | 
-| 英雄联盟         | 更新公告     | lol            | 
-| 米游社           | 最新消息     | miyoushe       | 
-| 原神             | 最新消息     | genshin        | 
-| 崩坏3            | 最新动态     | honkai         | 
-| 崩坏：星穹铁道   | 最新动态     | starrail       | 
-| 微信读书         | 飙升榜       | weread         | 
-| NGA              | 热帖         | ngabbs         | 
-| V2EX             | 主题榜       | v2ex           | 
-| HelloGitHub      | Trending     | hellogithub    | 
-| 中央气象台       | 全国气象预警 | weatheralarm   | 
-| 中国地震台       | 地震速报     | earthquake     | 
-| 历史上的今天     | 月-日        | history        |
-
-请用中文撰写这篇总结。
-
-{topics_text}
-
-"""
-    
-    print(f"\n📝 完整提示词预览:\n{'-'*60}")
-    print(prompt[:500] + "..." if len(prompt) > 500 else prompt)
-    print(f"{'-'*60}\n")
-
-    analysis_result = call_ollama(prompt, args.ollama_api, args.ollama_model,
-                                  args.max_retries, args.retry_delay)
-
-    if analysis_result:
-        print("\n" + "="*60, flush=True)
-        print("📊 分析结果", flush=True)
-        print("="*60, flush=True)
-        print(analysis_result, flush=True)
-        print("\n" + "="*60, flush=True)
-
-        os.makedirs(args.save_dir, exist_ok=True)
-        output = {
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "model_used": args.ollama_model,
-            "platforms_analyzed": list(all_topics.keys()),
-            "raw_data": all_topics,
-            "analysis": analysis_result
+                log(f"⚠️  {', '.join(batch)}: 摘要失败，汇总时使用原始热搜")
+            return {"platforms": batch, "summary": summary, "from_cache": from_cache,
+                    "seconds": elapsed, "generation": generation}
+
+    log(f"🗺️  map 阶段：{len(batches)} 个批次，并发 {config.map_concurrency}")
+    map_started = time.perf_counter()
+    map_results = await asyncio.gather(*(map_one(batch) for batch in batches))
+    map_seconds = time.perf_counter() - map_started
+
+    summaries = {}
+    for item in map_results:
+        batch = tuple(item["platforms"])
+        summaries[batch] = item["summary"] or prompts.format_topics({p: all_topics[p] for p in batch})
+
+    log("🧩 reduce 阶段：根据各平台摘要撰写最终报告")
+    reduce_started = time.perf_counter()
+    with metrics.span("prompt_build", stage="reduce"):
+        prompt = prompts.build_reduce_prompt(summaries, clusters)
+        options = prompts.build_options(prompt, config.num_predict, config.temperature, config.max_ctx)
+    log(prompts.describe(prompt, options))
+    analysis, reduce_from_cache, generation = await generate(client, config, prompt, options, log)
+    reduce_seconds = time.perf_counter() - reduce_started
+
+    stages = {
+        "map_summaries": {", ".join(batch): summary for batch, summary in summaries.items()},
+        "stage_timings": {
+            "map": round(map_seconds, 3),
+            "reduce": round(reduce_seconds, 3),
+            "map_batches": [{k: v for k, v in item.items() if k != "summary"} for item in map_results]
         }
-        filename = os.path.join(args.save_dir,
-                                f"hot_trends_analysis_{time.strftime('%Y%m%d_%H%M%S')}.json")
-
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(output, f, ensure_ascii=False, indent=2)
+    }
+    all_cached = reduce_from_cache and all(item["from_cache"] for item in map_results)
+    return analysis, all_cached, generation, stages
+
+
+async def fanout_analysis(client: httpx.AsyncClient, config: AnalysisConfig, models: List[str], prompt: Prompt,
+                          options: Dict, log: RunLogger, results: Optional[Dict[str, Dict]] = None,
+                          transcripts: Optional[Dict[str, List[str]]] = None) -> Tuple[Optional[str], Dict[str, Dict]]:
+    """把同一份提示词并发发送给多个模型，每个模型完成时推送带模型标签的 model_result 事件
+
+    返回 (作为主结果的模型, 各模型结果)。policy 为 all 时等待全部模型，主结果取请求顺序中第一个成功的；
+    为 first 时以最先成功的模型为主结果并取消其余模型。调用方被取消（任务取消、运行超时）时，
+    所有仍在生成的模型调用一并取消，不会在任务槽位释放后继续占用 Ollama。
+    调用方传入的 results 和 transcripts 会随各模型完成、生成逐步写入，超时取消后仍可用来组成部分报告。
+    """
+    semaphore = asyncio.Semaphore(max(1, config.model_concurrency))
+    results = {} if results is None else results
+    transcripts = {} if transcripts is None else transcripts
+
+    async def run_one(model: str) -> Dict:
+        model_log = log.labelled(model, transcripts.setdefault(model, []))
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                text, from_cache, generation = await generate(
+                    client, replace(config, ollama_model=model), prompt, options, model_log)
+                error = None if text else "模型未返回内容"
+            except Exception as e:
+                text, from_cache, generation, error = "", False, {}, str(e)
+        result = {
+            "status": "complete" if text else "failed",
+            "analysis": text,
+            "from_cache": from_cache,
+            "latency": round(time.perf_counter() - started, 3),
+            "generation": generation,
+            "error": error
+        }
+        results[model] = result
+        log.event({"type": "model_result", "model": model, **result})
+        return result
+
+    log(f"🔀 同一份提示词并发发送给 {len(models)} 个模型（并发 {config.model_concurrency}，策略 {config.fanout_policy}）")
+    tasks = {asyncio.create_task(run_one(model)): model for model in models}
+    pending = set(tasks)
+    first = None
+    try:
+        while pending and first is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if config.fanout_policy == "first":
+                first = next((tasks[task] for task in done if task.result()["status"] == "complete"), None)
+    finally:
+        if pending:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    if pending:
+        for task in pending:
+            results[tasks[task]] = {"status": "cancelled"}
+        log(f"✂️  {first} 已先完成，取消其余模型: {', '.join(tasks[task] for task in pending)}")
+
+    if first is None:
+        first = next((model for model in models if results.get(model, {}).get("status") == "complete"), None)
+    return first, {model: results.get(model, {"status": "cancelled"}) for model in models}
+
+
+def partial_comparisons(models: List[str], results: Dict[str, Dict],
+                        transcripts: Dict[str, List[str]]) -> Dict[str, Dict]:
+    """运行超时时的多模型对比结果：已完成的模型保留结果，未完成的标记为 partial（附已生成的文本）或 cancelled"""
+    comparisons = {}
+    for model in models:
+        if model in results:
+            comparisons[model] = results[model]
+            continue
+        streamed = "".join(transcripts.get(model, []))
+        comparisons[model] = {"status": "partial", "analysis": streamed} if streamed.strip() \
+            else {"status": "cancelled"}
+    return comparisons
+
+
+def baseline_key(config: AnalysisConfig) -> str:
+    """增量分析基线按 (模型, 平台, 条数, 是否聚类) 区分，与分析模式无关：任何模式的完整报告都可作为基线"""
+    return f"{config.ollama_model}|{','.join(config.platforms)}|{config.topics_per_platform}|{int(config.dedupe)}"
+
+
+async def incremental_analysis(client: httpx.AsyncClient, config: AnalysisConfig, all_topics: Dict[str, List[str]],
+                               snapshots: Dict[str, Dict], log: RunLogger) -> Tuple[Optional[Tuple], Dict]:
+    """增量模式：只把上一期报告和此后各平台的变化交给模型
+
+    不满足条件（没有基线、基线过旧、连续增量次数过多、变化过大）时返回 (None, 说明)，由调用方改用完整分析；
+    成功时返回 ((报告, 是否来自缓存, 生成耗时统计), 说明)。
+    """
+    store = config.snapshot_store
+    if store is None:
+        return None, {"fallback": "未配置快照存储"}
+    baseline = await asyncio.to_thread(store.get_baseline, baseline_key(config))
+    if baseline is None:
+        return None, {"fallback": "没有可用的上一期报告"}
+
+    age = time.time() - baseline["created_at"]
+    info = {"baseline_run_id": baseline["run_id"], "baseline_age_seconds": round(age, 1),
+            "chain": baseline["chain"] + 1}
+    if age > config.incremental_max_age:
+        return None, {**info, "fallback": f"上一期报告已超过 {config.incremental_max_age:.0f} 秒"}
+    if baseline["chain"] >= config.incremental_max_chain:
+        return None, {**info, "fallback": f"已连续增量更新 {baseline['chain']} 次，重新完整分析"}
+
+    deltas = {}
+    for platform, topics in all_topics.items():
+        snapshot_id = baseline["snapshots"].get(platform)
+        previous = await asyncio.to_thread(store.get, snapshot_id) if snapshot_id is not None else None
+        if previous is None:
+            return None, {**info, "fallback": f"上一期报告缺少 {platform} 的快照"}
+        deltas[platform] = diff_topics(previous["titles"], topics)
+
+    # 上一期报告没有涉及的条目：新上榜的，以及从分析范围之外升入前 topics_per_platform 的
+    total = sum(len(topics) for topics in all_topics.values())
+    changed = sum(len(diff["new"]) + sum(1 for m in diff["moved"] if m["previous_rank"] > len(all_topics[platform]))
+                  for platform, diff in deltas.items())
+    info["delta"] = {platform: diff_counts(diff) for platform, diff in deltas.items()}
+    if total and changed / total > config.incremental_max_change:
+        return None, {**info, "fallback": f"新进入榜单的条目占 {changed / total:.0%}，超过增量阈值"}
+
+    log(f"🔁 增量分析：基于 {age / 60:.0f} 分钟前的报告，{changed} 条新进入榜单")
+    with metrics.span("prompt_build"):
+        prompt = prompts.build_incremental_prompt(baseline["analysis"], deltas, round(age / 60))
+        options = prompts.build_options(prompt, config.num_predict, config.temperature, config.max_ctx)
+    log(prompts.describe(prompt, options) + "\n")
+    return await generate(client, config, prompt, options, log), info
+
+
+def save_result(output: Dict, save_dir: str) -> str:
+    """将分析结果写入 JSON 文件，返回文件路径"""
+    os.makedirs(save_dir, exist_ok=True)
+    filename = os.path.join(save_dir,
+                            f"hot_trends_analysis_{time.strftime('%Y%m%d_%H%M%S')}.json")
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    return filename
+
+
+async def analyze_hot_trends(config: AnalysisConfig, log: Optional[RunLogger] = None) -> Dict:
+    """主流程：获取 -> 提取 -> 构建提示词 -> 调用模型 -> 保存，返回分析结果
+
+    设置了 deadline 时，收集阶段最多占用剩余时间的一半；到时模型仍未完成则取消调用，
+    用已生成的文本（或原始热搜）输出标记为 partial 的部分报告。Ollama 熔断器拒绝调用时同样输出部分报告，
+    未设置 deadline 时则终止分析。
+    """
+    streamed: List[str] = []
+    log = (log or RunLogger()).recording(streamed)
+    trace = metrics.start_trace()
+    deadline_at = time.monotonic() + config.deadline if config.deadline else None
+    log("🚀 开始收集热搜数据...\n")
+
+    ollama_breaker = get_breaker(config, "ollama")
+    # 部分报告的原因：deadline（超过运行时限）或 ollama_breaker（Ollama 已熔断），None 表示完整报告
+    partial_reason = None
+    if ollama_breaker is not None and ollama_breaker.state == "open":
+        ollama_breaker.reject()
+        if deadline_at is None:
+            raise AnalysisError(
+                f"❌ Ollama 连续调用失败已熔断，{ollama_breaker.retry_after():.0f} 秒后再试探，本次分析终止")
+        partial_reason = "ollama_breaker"
+        log(f"⛔ Ollama 连续调用失败已熔断，{ollama_breaker.retry_after():.0f} 秒后再试探，本次只输出部分报告\n")
+
+    client = get_http_client()
+    models = config.compare_models or [config.ollama_model]
+    if partial_reason is None:
+        with metrics.span("ensure_model", model=",".join(models)):
+            ready = await asyncio.gather(*(prepare_model(client, config, model, log) for model in models))
+        unavailable = [model for model, ok in zip(models, ready) if not ok]
+        models = [model for model, ok in zip(models, ready) if ok]
+        if not models:
+            raise AnalysisError("❌ 无法准备 Ollama 模型，终止分析。")
+        if unavailable:
+            log(f"⚠️  以下模型暂不可用，不参与本次对比: {', '.join(unavailable)}")
+
+    collect_config = config
+    if deadline_at is not None:
+        # 给模型留出至少一半的剩余时间
+        collect_timeout = min(config.collect_timeout, (deadline_at - time.monotonic()) / 2)
+        collect_config = replace(config, collect_timeout=round(max(0.0, collect_timeout), 1))
+    all_topics, data_freshness, snapshots = await collect_hot_topics(client, collect_config, log)
 
-        print(f"\n💾 分析结果已保存至: {filename}", flush=True)
-    else:
-        print("\n❌ Ollama分析失败，请检查Ollama服务是否正常运行", flush=True)
+    if not all_topics:
+        raise AnalysisError("❌ 未能获取到任何热搜数据，请检查API服务是否正常")
+
+    clusters = None
+    if config.dedupe:
+        with metrics.span("cluster"):
+            clusters = cluster_topics(all_topics, threshold=config.cluster_threshold)
+        total = sum(len(topics) for topics in all_topics.values())
+        shared = sum(1 for c in clusters if len(c["platforms"]) > 1)
+        log(f"🔗 标题聚类：{total} 条热搜合并为 {len(clusters)} 个话题，其中 {shared} 个出现在多个平台")
+
+    log("\n" + "="*60)
+    log("🤖 正在使用 Ollama 分析热搜趋势...")
+    log("="*60 + "\n")
+
+    stages = {}
+    # 多模型对比时各模型的结果和已生成的文本，超时后用来组成部分报告
+    fanout_results: Dict[str, Dict] = {}
+    fanout_transcripts: Dict[str, List[str]] = {}
+
+    async def run_analysis() -> Tuple[str, bool, Dict, Optional[str], bool]:
+        """返回 (报告, 是否来自缓存, 生成耗时统计, 作为结果的模型, 是否为增量分析)"""
+        if config.analysis_mode == "incremental":
+            incremental, stages["incremental"] = await incremental_analysis(client, config, all_topics, snapshots, log)
+            if incremental is not None:
+                return (*incremental, config.ollama_model, True)
+            log(f"↩️  改用完整分析：{stages['incremental']['fallback']}")
+
+        if config.analysis_mode == "map_reduce":
+            text, from_cache, generation, map_stages = await map_reduce_analysis(
+                client, config, all_topics, clusters, log)
+            stages.update(map_stages)
+            return text, from_cache, generation, config.ollama_model, False
+
+        with metrics.span("prompt_build"):
+            prompt = prompts.build_prompt(all_topics, clusters)
+            options = prompts.build_options(prompt, config.num_predict, config.temperature, config.max_ctx)
+
+        log(f"\n📝 提示词数据部分预览:\n{'-'*60}")
+        log(prompt.user[:500] + "..." if len(prompt.user) > 500 else prompt.user)
+        log(f"{'-'*60}")
+        log(prompts.describe(prompt, options) + "\n")
+
+        if not config.compare_models:
+            return (*await generate(client, config, prompt, options, log), config.ollama_model, False)
+        model_used, stages["comparisons"] = await fanout_analysis(client, config, models, prompt, options, log,
+                                                                  fanout_results, fanout_transcripts)
+        if model_used is None:
+            raise AnalysisError("❌ 所有模型的分析均失败，请检查Ollama服务是否正常运行")
+        primary = stages["comparisons"][model_used]
+        return primary["analysis"], primary["from_cache"], primary["generation"], model_used, False
+
+    def breaker_rejected() -> bool:
+        # 有时限的运行在 Ollama 熔断时不终止，改为输出部分报告
+        return deadline_at is not None and ollama_breaker is not None and ollama_breaker.state == "open"
+
+    analysis_result, from_cache, generation, model_used, incremental = "", False, {}, config.ollama_model, False
+    if partial_reason is None:
+        remaining = max(0.0, deadline_at - time.monotonic()) if deadline_at is not None else None
+        try:
+            analysis_result, from_cache, generation, model_used, incremental = await asyncio.wait_for(
+                run_analysis(), timeout=remaining)
+        except asyncio.TimeoutError:
+            if deadline_at is None:
+                raise
+            partial_reason = "deadline"
+            log(f"\n⏰ 已到达 {config.deadline:.0f} 秒的运行时限，停止模型调用并输出部分报告")
+        except AnalysisError:
+            if not breaker_rejected():
+                raise
+        if partial_reason is None and not analysis_result and breaker_rejected():
+            partial_reason = "ollama_breaker"
+            log("\n⛔ Ollama 在分析过程中熔断，输出部分报告")
+
+    if partial_reason is not None:
+        from_cache, generation, incremental = False, {}, False
+        model_used, partial_text, primary = config.ollama_model, "".join(streamed), {}
+        if config.compare_models:
+            # 有模型已完成时以请求顺序中第一个完成的为主结果，否则取第一个已生成内容的模型
+            comparisons = stages["comparisons"] = partial_comparisons(models, fanout_results, fanout_transcripts)
+            model_used = next((m for m in models if comparisons[m]["status"] == "complete"), None) or \
+                next((m for m in models if comparisons[m]["status"] == "partial"), None)
+            primary = comparisons[model_used] if model_used is not None else {}
+            partial_text = primary.get("analysis", "")
+        if primary.get("status") == "complete":
+            analysis_result, from_cache, generation = partial_text, primary["from_cache"], primary["generation"]
+        else:
+            reason = f"本次运行超过 {config.deadline:.0f} 秒的时限" if partial_reason == "deadline" \
+                else "Ollama 连续调用失败已熔断"
+            analysis_result = prompts.build_partial_report(partial_text, all_topics, clusters, reason)
+    partial = partial_reason is not None
+
+    if not analysis_result:
+        raise AnalysisError("❌ Ollama分析失败，请检查Ollama服务是否正常运行")
+
+    log("\n" + "="*60)
+    log("📊 分析结果")
+    log("="*60)
+    log(analysis_result)
+    log("\n" + "="*60)
+
+    output = {
+        "id": config.run_id,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "model_used": model_used,
+        "platforms_analyzed": list(all_topics.keys()),
+        "raw_data": {**all_topics, "_clusters": clusters} if clusters is not None else all_topics,
+        "data_freshness": data_freshness,
+        # 各平台相对上一份快照的变化条数
+        "changes": {
+            platform: diff_counts(diff_topics(snapshot["previous"]["titles"], all_topics[platform]))
+            for platform, snapshot in snapshots.items() if snapshot["previous"] is not None
+        },
+        "from_cache": from_cache,
+        "generation": generation,
+        "mode": config.analysis_mode,
+        # partial 为 True 表示运行超过 deadline 秒或 Ollama 已熔断（partial_reason 区分）：
+        # analysis 只是部分报告，或多模型对比中只有部分模型完成
+        "partial": partial,
+        "partial_reason": partial_reason,
+        "deadline": config.deadline,
+        **stages,
+        # 保存之前的各阶段 span；persist 本身的耗时只计入指标
+        "spans": trace.to_list(),
+        "analysis": analysis_result
+    }
+    with metrics.span("persist"):
+        if config.result_store is not None and config.run_id:
+            filename = await asyncio.to_thread(config.result_store.save, config.run_id, output)
+        else:
+            filename = await asyncio.to_thread(save_result, output, config.save_dir)
+        # 部分报告不作为增量分析的基线
+        if config.snapshot_store is not None and snapshots and not partial:
+            chain = stages["incremental"]["chain"] if incremental else 0
+            await asyncio.to_thread(config.snapshot_store.set_baseline,
+                                    baseline_key(replace(config, ollama_model=model_used)), config.run_id,
+                                    analysis_result, {p: s["id"] for p, s in snapshots.items()}, chain)
+
+    log(f"\n💾 分析结果已保存至: {filename}")
+    return output
+
+
+async def run_pipeline(config: AnalysisConfig, queue: asyncio.Queue):
+    """在事件循环中执行分析，并把 log/complete/error 事件依次推送到队列，最后推送 None 表示结束"""
+    started = time.perf_counter()
+    status = "failed"
+    try:
+        result = await analyze_hot_trends(config, RunLogger(queue))
+        status = "partial" if result["partial"] else "complete"
+        await queue.put({"type": "complete", "result": result, "timings": result["generation"]})
+    except AnalysisError as e:
+        await queue.put({"type": "error", "message": str(e)})
+    except Exception as e:
+        await queue.put({"type": "error", "message": f"执行出错: {str(e)}"})
+    finally:
+        metrics.RUNS.inc(status=status)
+        metrics.RUN_SECONDS.observe(time.perf_counter() - started, status=status)
+        await queue.put(None)
 
 
 if __name__ == "__main__":
@@ -286,7 +948,17 @@ if __name__ == "__main__":
     print("   网络热搜分析工具 - 命令行配置版", flush=True)
     print("="*60 + "\n", flush=True)
 
+    async def cli_main(config: AnalysisConfig):
+        try:
+            await analyze_hot_trends(config)
+        finally:
+            await close_http_client()
+
     args = parse_args()
-    analyze_hot_trends(args)
+    try:
+        asyncio.run(cli_main(AnalysisConfig(**vars(args))))
+    except AnalysisError as e:
+        print(f"\n{e}", flush=True)
+        sys.exit(1)
 
-    print("\n✨ 分析完成！", flush=True)
\ No newline at end of file
+    print("\n✨ 分析完成！", flush=True)
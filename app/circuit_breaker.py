@@ -0,0 +1,165 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+import metrics
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+    def __init__(self, breaker: "CircuitBreaker"):
+        super().__init__(f"{breaker.name} 已熔断，{breaker.retry_after():.0f} 秒后再试探")
+        self.breaker = breaker
+
+
+class CircuitBreaker:
+    """单个上游的熔断器
+
+    - closed：正常放行，连续失败 failure_threshold 次后打开
+    - open：直接拒绝，reset_timeout 秒后进入 half_open
+    - half_open：只放行 half_open_max 个试探请求；试探成功则关闭，失败则重新打开，
+      且下一次的等待时间加倍（不超过 max_reset_timeout）
+    状态只保存在当前进程内，多 worker 部署时各进程分别判断。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30,
+                 max_reset_timeout: float = 300, half_open_max: int = 1):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max(reset_timeout, max_reset_timeout)
+        self.half_open_max = max(1, half_open_max)
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.open_for = reset_timeout
+        self.probes = 0
+        self.last_error: Optional[str] = None
+        self.last_failure_at: Optional[float] = None
+        self.rejected = 0
+        self.opened_count = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.open_for:
+            return "open"
+        return "half_open"
+
+    def retry_after(self) -> float:
+        """距离下一次允许试探的秒数，未打开时为 0"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_for - time.monotonic())
+
+    def allow(self) -> bool:
+        """是否放行一次调用；half_open 状态下放行时占用一个试探名额，需以 record_* 或 release 结束"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and self.probes < self.half_open_max:
+            self.probes += 1
+            return True
+        self.reject()
+        return False
+
+    def reject(self):
+        """记录一次被直接拒绝的调用"""
+        self.rejected += 1
+        metrics.BREAKER_REJECTIONS.inc(breaker=self.name)
+
+    def record_success(self):
+        if self.opened_at is not None:
+            print(f"🟢 {self.name} 试探成功，熔断恢复", flush=True)
+        self.failures = 0
+        self.opened_at = None
+        self.open_for = self.reset_timeout
+        self.probes = 0
+
+    def record_failure(self, error: BaseException):
+        self.last_error = (str(error).splitlines() or [error.__class__.__name__])[0]
+        self.last_failure_at = time.time()
+        if self.opened_at is not None:
+            # 试探失败：重新打开，等待时间加倍
+            self.open_for = min(self.max_reset_timeout, self.open_for * 2)
+            self._open()
+            return
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.open_for = self.reset_timeout
+            self._open()
+
+    def release(self):
+        """调用被取消（既不算成功也不算失败）时归还试探名额"""
+        if self.probes:
+            self.probes -= 1
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self.probes = 0
+        self.opened_count += 1
+        print(f"🔴 {self.name} 熔断 {self.open_for:.0f} 秒: {self.last_error}", flush=True)
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at = None
+        self.open_for = self.reset_timeout
+        self.probes = 0
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        """保护一次调用：被拒绝时抛出 CircuitOpenError；异常计为失败，正常结束计为成功"""
+        if not self.allow():
+            raise CircuitOpenError(self)
+        try:
+            yield
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        except BaseException:
+            # 取消等不代表上游故障
+            self.release()
+            raise
+        self.record_success()
+
+    def snapshot(self) -> Dict:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+            "open_for": self.open_for,
+            "opened_count": self.opened_count,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+            "last_failure_at": self.last_failure_at
+        }
+
+
+class BreakerRegistry:
+    """按名称管理熔断器（如 platform:weibo、ollama），首次使用时按统一参数创建"""
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30, max_reset_timeout: float = 300,
+                 half_open_max: int = 1):
+        self.options = {"failure_threshold": failure_threshold, "reset_timeout": reset_timeout,
+                        "max_reset_timeout": max_reset_timeout, "half_open_max": half_open_max}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(name, **self.options)
+        return breaker
+
+    def find(self, name: str) -> Optional[CircuitBreaker]:
+        return self._breakers.get(name)
+
+    def open_count(self) -> int:
+        return sum(1 for breaker in self._breakers.values() if breaker.state != "closed")
+
+    def snapshot(self) -> Dict:
+        return {
+            "options": self.options,
+            "breakers": [breaker.snapshot() for _, breaker in sorted(self._breakers.items())]
+        }
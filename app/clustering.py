@@ -0,0 +1,113 @@
+import re
+from collections import defaultdict
+from typing import Callable, Dict, List, Set
+
+# 只保留中日韩文字、字母和数字，标点、空白、emoji 等不参与相似度计算
+_NON_WORD = re.compile(r"[^0-9a-z㐀-鿿豈-﫿]+")
+
+
+def normalize_title(title: str) -> str:
+    return _NON_WORD.sub("", title.lower())
+
+
+def char_ngrams(text: str, n: int = 2) -> Set[str]:
+    """字符 n-gram；中文没有空格分词，字符二元组比词更稳健。过短的文本退化为单字"""
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, x: int) -> int:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def cluster_topics(all_topics: Dict[str, List[str]], threshold: float = 0.6,
+                   max_posting: int = 200) -> List[Dict]:
+    """对各平台热搜做近似去重聚类
+
+    用字符二元组的倒排索引找出至少共享一个 n-gram 的候选对，只对候选对计算 Dice 相似度，
+    避免对全部标题两两比较；相似度不低于 threshold 的跨平台标题用并查集合并为同一簇。
+    出现次数超过 max_posting 的 n-gram 过于常见，不用于生成候选。
+
+    返回的簇按来源平台数从多到少排列，每个簇包含代表标题、来源平台和各平台的原始标题与排名。
+    """
+    items = []
+    for platform, topics in all_topics.items():
+        for rank, title in enumerate(topics, 1):
+            items.append({"platform": platform, "title": title, "rank": rank})
+
+    grams = [char_ngrams(normalize_title(item["title"])) for item in items]
+    postings: Dict[str, List[int]] = defaultdict(list)
+    uf = _UnionFind(len(items))
+
+    for i, item_grams in enumerate(grams):
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in item_grams:
+            posting = postings[gram]
+            if len(posting) <= max_posting:
+                for j in posting:
+                    shared[j] += 1
+            posting.append(i)
+        for j, count in shared.items():
+            # 只合并不同平台的标题，同一平台内的相似条目（如系列话题）仍各自保留
+            if items[j]["platform"] == items[i]["platform"]:
+                continue
+            if 2 * count / (len(item_grams) + len(grams[j])) >= threshold:
+                uf.union(i, j)
+
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i in range(len(items)):
+        groups[uf.find(i)].append(i)
+
+    clusters = []
+    for members in groups.values():
+        variants = [items[i] for i in members]
+        platforms = list(dict.fromkeys(v["platform"] for v in variants))
+        # 代表标题取排名最靠前的一条
+        representative = items[min(members, key=lambda i: (items[i]["rank"], i))]
+        clusters.append({
+            "title": representative["title"],
+            "platforms": platforms,
+            "variants": variants
+        })
+    clusters.sort(key=lambda c: (-len(c["platforms"]), min(v["rank"] for v in c["variants"])))
+    return clusters
+
+
+def format_clusters(clusters: List[Dict], platforms: List[str],
+                    label: Callable[[str], str] = str, source: Callable[[str], str] = str) -> str:
+    """把聚类结果排成提示词文本：跨平台的热点只出现一次并标注来源，其余标题按平台列出并保留原排名
+
+    label / source 分别决定平台标题和来源标注中平台的显示名称。
+    """
+    shared = [c for c in clusters if len(c["platforms"]) > 1]
+    topics_text = ""
+    if shared:
+        topics_text += "\n【多平台共同热点】\n"
+        for i, cluster in enumerate(shared, 1):
+            sources = "、".join(f"{source(v['platform'])}#{v['rank']}" for v in cluster["variants"])
+            topics_text += f"{i}. {cluster['title']}（来源：{sources}）\n"
+
+    by_platform: Dict[str, List[Dict]] = defaultdict(list)
+    for cluster in clusters:
+        if len(cluster["platforms"]) == 1:
+            by_platform[cluster["platforms"][0]].extend(cluster["variants"])
+    for platform in platforms:
+        if not by_platform.get(platform):
+            continue
+        topics_text += f"\n【{label(platform)}】\n"
+        for v in sorted(by_platform[platform], key=lambda v: v["rank"]):
+            topics_text += f"{v['rank']}. {v['title']}\n"
+    return topics_text
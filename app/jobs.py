@@ -0,0 +1,549 @@
+import asyncio
+import heapq
+import json
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple, Union
+
+
+class Job:
+    """一次分析任务：事件带递增 ID 存入有界环形缓冲区，供多个订阅者（含中途重新连接的客户端）回放与实时接收
+
+    订阅者按 ID 从缓冲区读取，读得慢的客户端不会让事件在内存中堆积；落后太多时跳过已被淘汰的事件。
+    token 事件数量远多于其他事件，单独存放在另一个同样大小的缓冲区中，不会把日志、排队等事件挤出回放范围。
+    """
+
+    def __init__(self, key: Hashable, config: Any, replay_limit: int = 2000,
+                 cancel_when_orphaned: bool = False):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.config = config
+        self.status = "queued"  # queued / running / complete / failed
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.subscriber_count = 0
+        self.active_subscribers = 0
+        self.waiters = 0
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.events: Deque[Tuple[int, Dict]] = deque(maxlen=replay_limit)
+        self.token_events: Deque[Tuple[int, Dict]] = deque(maxlen=replay_limit)
+        self.last_event_id = 0
+        # 为 True 时，所有订阅者断开且无人等待结果的任务可被取消（由 JobManager 的 orphan_policy 决定）
+        self.cancel_when_orphaned = cancel_when_orphaned
+        self.on_orphaned: Optional[Callable[["Job"], None]] = None
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_reason = "任务已取消"
+        # 启用共享状态时：执行本任务的 worker，以及已同步到共享状态的最后一个事件 ID
+        self.worker: Optional[str] = None
+        self.synced_event_id = 0
+        self.synced = False
+        self._wakeup = asyncio.Event()
+        self._done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def orphaned(self) -> bool:
+        """尚未结束，且既没有订阅者也没有等待结果的调用方"""
+        return not self.finished and self.active_subscribers == 0 and self.waiters == 0
+
+    def publish(self, event: Dict):
+        """记录事件并唤醒所有订阅者"""
+        if event["type"] == "complete":
+            self.result = event.get("result")
+        elif event["type"] == "error":
+            self.error = event.get("message")
+        self.last_event_id += 1
+        buffer = self.token_events if event["type"] == "token" else self.events
+        buffer.append((self.last_event_id, event))
+        self._notify()
+
+    def _notify(self):
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    def finish(self):
+        self.status = "complete" if self.result is not None else "failed"
+        self.finished_at = time.time()
+        self._done.set()
+        self._notify()
+
+    async def wait(self):
+        self.waiters += 1
+        try:
+            await self._done.wait()
+        finally:
+            self.waiters -= 1
+
+    def _events_after(self, event_id: int) -> List[Tuple[int, Dict]]:
+        # 新事件都在缓冲区尾部，从后往前取，开销与新事件数量成正比；两个缓冲区的结果按 ID 合并
+        batches = []
+        for buffer in (self.events, self.token_events):
+            batch = []
+            for item in reversed(buffer):
+                if item[0] <= event_id:
+                    break
+                batch.append(item)
+            batch.reverse()
+            batches.append(batch)
+        if not batches[1]:
+            return batches[0]
+        return list(heapq.merge(*batches, key=lambda item: item[0]))
+
+    async def subscribe(self, last_event_id: int = 0,
+                        heartbeat: Optional[float] = None) -> AsyncIterator[List[Tuple[Optional[int], Dict]]]:
+        """回放 last_event_id 之后的事件并实时接收后续事件，每次产出当前可读的一批 (事件 ID, 事件)
+
+        所需事件已被环形缓冲区淘汰时（包括批次中间被淘汰的 token 事件），批次开头插入一条 ID 为 None 的提示日志；
+        指定 heartbeat 时，超过该秒数没有新事件会产出空批次，便于调用方发送心跳。任务结束时迭代终止。
+        """
+        self.subscriber_count += 1
+        self.active_subscribers += 1
+        position = last_event_id
+        try:
+            while True:
+                wakeup = self._wakeup
+                batch = self._events_after(position)
+                if batch:
+                    skipped = batch[-1][0] - position - len(batch)
+                    position = batch[-1][0]
+                    if skipped > 0:
+                        batch.insert(0, (None, {"type": "log", "message": f"⋯ 已省略 {skipped} 条较早的事件"}))
+                    yield batch
+                    continue
+                if self.finished:
+                    return
+                try:
+                    await asyncio.wait_for(wakeup.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield []
+        finally:
+            self.active_subscribers -= 1
+            if self.orphaned and self.on_orphaned is not None:
+                self.on_orphaned(self)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "subscribers": self.subscriber_count,
+            "active_subscribers": self.active_subscribers,
+            "last_event_id": self.last_event_id,
+            "run_id": (self.result or {}).get("id"),
+            "error": self.error,
+            "worker": self.worker
+        }
+
+
+class RemoteJob:
+    """由其他 worker 执行的任务：从共享状态轮询事件，提供与 Job 相同的订阅、等待和概况接口
+
+    执行方的心跳超过 state.stale_after 秒未更新时视为失联，任务按失败结束。
+    """
+
+    def __init__(self, info: Dict[str, Any], state: Any, poll_interval: float = 0.25):
+        self.id = info["job_id"]
+        self.state = state
+        self.poll_interval = poll_interval
+        self.subscriber_count = 0
+        self.active_subscribers = 0
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        # 执行方失联或记录过期：任务不会再发布结束事件
+        self.lost = False
+        self.info = info
+        self._update(info)
+
+    @property
+    def status(self) -> str:
+        return self.info["status"]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("complete", "failed")
+
+    def _update(self, info: Optional[Dict[str, Any]]):
+        if info is None:
+            # 记录已被清理：按失败处理，让订阅者和等待方结束
+            info = {**self.info, "status": "failed", "error": self.info.get("error") or "任务记录已过期"}
+            self.lost = True
+        elif info["status"] not in ("complete", "failed") and \
+                info["heartbeat_at"] < time.time() - self.state.stale_after:
+            info = {**info, "status": "failed", "error": f"执行任务的 worker {info['worker']} 已失联"}
+            self.lost = True
+        self.info = info
+        if info.get("error"):
+            self.error = info["error"]
+
+    def _apply(self, batch: List[Tuple[int, Dict]]):
+        for _, event in batch:
+            if event["type"] == "complete":
+                self.result = event.get("result")
+            elif event["type"] == "error":
+                self.error = event.get("message")
+
+    async def _read(self, after: int) -> List[Tuple[int, Dict]]:
+        info, batch = await asyncio.to_thread(self.state.read, self.id, after)
+        self._update(info)
+        self._apply(batch)
+        return batch
+
+    async def wait(self):
+        # 与订阅者一样通过 read 轮询，刷新 subscriber_seen_at，执行方不会把仍有人等待的任务当作无人订阅而取消；
+        # 只读取加入之后的新事件，结束后再读取最后一个事件（complete 或 error）
+        position = self.info["last_event_id"]
+        while True:
+            batch = await self._read(position)
+            if batch:
+                position = batch[-1][0]
+            if self.finished:
+                break
+            await asyncio.sleep(self.poll_interval)
+        await self._read(max(0, self.info["last_event_id"] - 1))
+
+    async def subscribe(self, last_event_id: int = 0,
+                        heartbeat: Optional[float] = None) -> AsyncIterator[List[Tuple[Optional[int], Dict]]]:
+        """与 Job.subscribe 相同；执行方失联或记录过期时补发一条错误事件"""
+        self.subscriber_count += 1
+        self.active_subscribers += 1
+        position = last_event_id
+        terminated = False
+        idle = 0.0
+        try:
+            while True:
+                batch = await self._read(position)
+                if batch:
+                    skipped = batch[0][0] - position - 1
+                    position = batch[-1][0]
+                    terminated = terminated or any(event["type"] in ("complete", "error") for _, event in batch)
+                    if skipped > 0:
+                        batch.insert(0, (None, {"type": "log", "message": f"⋯ 已省略 {skipped} 条较早的事件"}))
+                    idle = 0.0
+                    yield batch
+                    continue
+                if self.finished:
+                    if self.lost and not terminated:
+                        yield [(None, {"type": "error", "message": self.error or "任务已结束"})]
+                    return
+                await asyncio.sleep(self.poll_interval)
+                idle += self.poll_interval
+                if heartbeat is not None and idle >= heartbeat:
+                    idle = 0.0
+                    yield []
+        finally:
+            self.active_subscribers -= 1
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.info["created_at"],
+            "started_at": None,
+            "finished_at": self.info["finished_at"],
+            "subscribers": self.subscriber_count,
+            "active_subscribers": self.active_subscribers,
+            "last_event_id": self.info["last_event_id"],
+            "run_id": (self.result or {}).get("id"),
+            "error": self.error,
+            "worker": self.info["worker"]
+        }
+
+
+class JobManager:
+    """分析任务调度
+
+    - 固定数量的 worker 按 FIFO 顺序执行任务，并发数与 Ollama 的承载能力匹配
+    - 排队中的任务会收到 queue 事件，告知当前排队位置（开始执行时位置为 0）
+    - key 相同的进行中任务会被合并，所有请求共享同一次执行结果
+    - 结束的任务保留 retention 秒，期间可通过 ID 重新订阅
+    - 标记了 cancel_when_orphaned 的任务在客户端全部断开 orphan_grace 秒后，
+      按 orphan_policy 取消（cancel）或继续在后台执行（detach）
+    - 配置了共享状态（shared_state.SQLiteState / RedisState）时，任务合并跨 worker 进程生效：
+      本进程执行的任务每隔 sync_interval 秒把新事件和心跳同步到共享状态，
+      其他进程执行的任务以 RemoteJob 的形式返回，可照常订阅、等待和取消；
+      concurrency 同时是所有 worker 合计的上限：任务执行前占用共享状态中的 analysis 槽位（计数租约），
+      执行期间随同步续期，结束后释放，执行方失联时槽位在 stale_after 秒后过期
+    """
+
+    # 共享状态中分析槽位的名称，以及槽位已满时重新尝试的间隔
+    slot_name = "analysis"
+    slot_poll_interval = 1.0
+
+    def __init__(self, runner: Callable[[Job], Awaitable[None]], concurrency: int = 1,
+                 retention: float = 600, replay_limit: int = 2000,
+                 orphan_policy: str = "cancel", orphan_grace: float = 30,
+                 state: Any = None, worker_id: Optional[str] = None, sync_interval: float = 0.25):
+        self.runner = runner
+        self.concurrency = max(1, concurrency)
+        self.retention = retention
+        self.replay_limit = replay_limit
+        self.orphan_policy = orphan_policy
+        self.orphan_grace = orphan_grace
+        self.state = state
+        self.worker_id = worker_id or uuid.uuid4().hex[:8]
+        self.sync_interval = sync_interval
+        self.cancelled = 0
+        self.remote_joined = 0
+        self._jobs: Dict[str, Job] = {}
+        self._inflight: Dict[Hashable, Job] = {}
+        self._waiting: Deque[Job] = deque()
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._reapers: Set[asyncio.Task] = set()
+        self._sync_task: Optional[asyncio.Task] = None
+        self._claim_lock: Optional[asyncio.Lock] = None
+        # 本进程持有分析槽位的任务 ID，以及上一次续期的时间
+        self._slots: Set[str] = set()
+        self._slots_renewed_at = 0.0
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._claim_lock = asyncio.Lock()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        if self.state is not None:
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        for task in [*self._workers, *self._reapers]:
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._reapers, return_exceptions=True)
+        self._workers = []
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+            self._sync_task = None
+            # 把被中断任务的最后状态写入共享状态，其他 worker 上的订阅者能及时结束
+            await self._sync()
+
+    async def submit(self, key: Hashable, config: Any,
+                     cancel_when_orphaned: bool = False) -> Tuple[Union[Job, RemoteJob], bool]:
+        """提交任务，返回 (任务, 是否合并到已有任务)；合并时沿用已有任务的 cancel_when_orphaned
+
+        启用共享状态时，其他 worker 上 key 相同的进行中任务也会被合并，返回对应的 RemoteJob。
+        """
+        self._prune()
+        job = self._inflight.get(key)
+        if job is not None:
+            return job, True
+        if self.state is None:
+            return self._enqueue(Job(key, config, self.replay_limit, cancel_when_orphaned)), False
+
+        # 登记期间会让出事件循环，加锁避免本进程内相同 key 的请求重复登记
+        async with self._claim_lock:
+            job = self._inflight.get(key)
+            if job is not None:
+                return job, True
+            job = Job(key, config, self.replay_limit, cancel_when_orphaned)
+            owner = await asyncio.to_thread(self.state.claim, self._state_key(key), job.id, self.worker_id)
+            if owner["job_id"] != job.id:
+                self.remote_joined += 1
+                return RemoteJob(owner, self.state, self.sync_interval), True
+            return self._enqueue(job), False
+
+    @staticmethod
+    def _state_key(key: Hashable) -> str:
+        return json.dumps(key, ensure_ascii=False)
+
+    def _enqueue(self, job: Job) -> Job:
+        job.on_orphaned = self._orphaned
+        job.worker = self.worker_id
+        self._jobs[job.id] = job
+        self._inflight[job.key] = job
+        self._waiting.append(job)
+        self._queue.put_nowait(job)
+        job.publish({"type": "queue", "position": len(self._waiting)})
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def lookup(self, job_id: str) -> Optional[Union[Job, RemoteJob]]:
+        """按 ID 查找任务：先查本进程，启用共享状态时再查其他 worker 执行的任务"""
+        job = self._jobs.get(job_id)
+        if job is not None or self.state is None:
+            return job
+        info = await asyncio.to_thread(self.state.get_job, job_id)
+        return RemoteJob(info, self.state, self.sync_interval) if info is not None else None
+
+    async def request_cancel(self, job: Union[Job, RemoteJob], reason: str = "任务已取消"):
+        """取消任务；其他 worker 执行的任务由执行方在下一次同步时取消"""
+        if isinstance(job, RemoteJob):
+            await asyncio.to_thread(self.state.request_cancel, job.id)
+        else:
+            self.cancel(job, reason)
+
+    def cancel(self, job: Job, reason: str = "任务已取消"):
+        """取消任务：排队中的直接出队，执行中的取消其执行协程"""
+        if job.finished:
+            return
+        self.cancelled += 1
+        job.cancel_reason = reason
+        if job.task is not None:
+            job.task.cancel()
+            return
+        self._waiting.remove(job)
+        self._inflight.pop(job.key, None)
+        job.publish({"type": "error", "message": reason})
+        job.finish()
+        self._publish_positions()
+
+    def _orphaned(self, job: Job):
+        if not job.cancel_when_orphaned:
+            return
+        if self.orphan_policy != "cancel":
+            print(f"🔌 任务 {job.id} 的客户端已全部断开，继续在后台执行", flush=True)
+            return
+        reaper = asyncio.create_task(self._reap(job))
+        self._reapers.add(reaper)
+        reaper.add_done_callback(self._reapers.discard)
+
+    async def _reap(self, job: Job):
+        # 宽限期内客户端可以带 Last-Event-ID 重新连接（也可能连到其他 worker）
+        while True:
+            await asyncio.sleep(self.orphan_grace)
+            if not job.orphaned or not await self._remote_subscribed(job):
+                break
+        if job.orphaned:
+            print(f"🔌 任务 {job.id} 的客户端断开超过 {self.orphan_grace:.0f} 秒，取消任务", flush=True)
+            self.cancel(job, "客户端已断开，任务已取消")
+
+    async def _remote_subscribed(self, job: Job) -> bool:
+        """宽限期内是否有其他 worker 上的订阅者读取过该任务的事件"""
+        if self.state is None:
+            return False
+        info = await asyncio.to_thread(self.state.get_job, job.id)
+        seen_at = (info or {}).get("subscriber_seen_at")
+        return seen_at is not None and seen_at >= time.time() - self.orphan_grace
+
+    def stats(self) -> Dict[str, Any]:
+        """本进程的任务概况；多 worker 部署时各进程分别统计"""
+        return {
+            "concurrency": self.concurrency,
+            "queued": len(self._waiting),
+            "running": sum(1 for job in self._inflight.values() if job.status == "running"),
+            "jobs": len(self._jobs),
+            "cancelled": self.cancelled,
+            "orphan_policy": self.orphan_policy,
+            "worker": self.worker_id,
+            "shared_state": self.state.backend if self.state is not None else "local",
+            "remote_joined": self.remote_joined
+        }
+
+    async def _sync_loop(self):
+        last_prune = 0.0
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self._sync()
+                if time.monotonic() - last_prune > 60:
+                    last_prune = time.monotonic()
+                    await asyncio.to_thread(self.state.prune, self.retention)
+            except Exception as e:
+                print(f"⚠️ 同步任务状态失败: {e}", flush=True)
+
+    async def _sync(self):
+        """把本进程任务的新事件、状态和心跳写入共享状态，并处理其他 worker 发来的取消请求"""
+        events, alive, finished, synced = {}, {}, [], []
+        for job in self._jobs.values():
+            if job.synced:
+                continue
+            batch = job._events_after(job.synced_event_id)
+            if batch:
+                events[job.id] = batch
+            if job.finished:
+                finished.append((job.id, job.status, job.error))
+            else:
+                alive[job.id] = job.status
+            synced.append((job, batch[-1][0] if batch else job.synced_event_id, job.finished))
+        if not synced:
+            return
+
+        cancel_ids = await asyncio.to_thread(self.state.sync, events, alive, finished, self.replay_limit)
+        for job, event_id, finished_before in synced:
+            job.synced_event_id = event_id
+            job.synced = finished_before
+        if self._slots and time.monotonic() - self._slots_renewed_at > self.state.stale_after / 3:
+            self._slots_renewed_at = time.monotonic()
+            for job_id in list(self._slots):
+                if not await asyncio.to_thread(self.state.acquire_slot, self.slot_name, job_id,
+                                               self.concurrency, self.state.stale_after):
+                    print(f"⚠️ 任务 {job_id} 的分析槽位已过期，续期失败", flush=True)
+        for job_id in cancel_ids:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                print(f"🛑 任务 {job_id} 已在其他 worker 上被取消", flush=True)
+                self.cancel(job, "任务已取消")
+
+    async def _acquire_slot(self, job: Job) -> bool:
+        """等待共享状态中的分析槽位，所有 worker 合计最多 concurrency 个任务同时执行；等待期间任务被取消时返回 False"""
+        notified = False
+        while not job.finished:
+            if await asyncio.to_thread(self.state.acquire_slot, self.slot_name, job.id,
+                                       self.concurrency, self.state.stale_after):
+                if job.finished:
+                    await self._release_slot(job.id)
+                    return False
+                self._slots.add(job.id)
+                return True
+            if not notified:
+                notified = True
+                job.publish({"type": "log", "message": "⏳ 所有 worker 的分析并发已满，等待其他任务结束..."})
+            await asyncio.sleep(self.slot_poll_interval)
+        return False
+
+    async def _release_slot(self, job_id: str):
+        self._slots.discard(job_id)
+        try:
+            await asyncio.to_thread(self.state.release_slot, self.slot_name, job_id)
+        except Exception as e:
+            print(f"⚠️ 释放任务 {job_id} 的分析槽位失败: {e}", flush=True)
+
+    def _publish_positions(self):
+        for position, waiting_job in enumerate(self._waiting, 1):
+            waiting_job.publish({"type": "queue", "position": position})
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job.finished:
+                continue  # 排队期间已被取消
+            if self.state is not None and not await self._acquire_slot(job):
+                continue
+            self._waiting.remove(job)
+            self._publish_positions()
+
+            job.status = "running"
+            job.started_at = time.time()
+            job.publish({"type": "queue", "position": 0})
+            # 在独立的任务中执行，取消单个任务不会影响 worker 本身
+            job.task = asyncio.create_task(self.runner(job))
+            try:
+                await asyncio.wait({job.task})
+                if job.task.cancelled():
+                    job.publish({"type": "error", "message": job.cancel_reason})
+                elif job.task.exception() is not None:
+                    job.publish({"type": "error", "message": f"执行出错: {str(job.task.exception())}"})
+            except asyncio.CancelledError:
+                job.task.cancel()
+                await asyncio.gather(job.task, return_exceptions=True)
+                job.publish({"type": "error", "message": "任务已取消"})
+                raise
+            finally:
+                self._inflight.pop(job.key, None)
+                job.finish()
+                if job.id in self._slots:
+                    await self._release_slot(job.id)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,65 @@
+import asyncio
+import sys
+from typing import List, Optional, TextIO
+
+
+class BatchedLogWriter:
+    """运行日志的批量写入器
+
+    write 只把行追加到内存缓冲区；后台任务每隔 flush_interval 秒（或缓冲区达到 max_batch 行时）
+    在线程中把整批写入日志文件并输出到标准输出，事件循环上不做文件 I/O。
+    用法：async with BatchedLogWriter(path) as writer: writer.write(line)
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.5, max_batch: int = 200, echo: bool = True):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.echo = echo
+        self._buffer: List[str] = []
+        self._file: Optional[TextIO] = None
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "BatchedLogWriter":
+        self._file = await asyncio.to_thread(open, self.path, "w", encoding="utf-8")
+        self._task = asyncio.create_task(self._loop())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+        await asyncio.to_thread(self._file.close)
+
+    def write(self, line: str):
+        self._buffer.append(line)
+        if len(self._buffer) >= self.max_batch:
+            self._full.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        # 加锁保证各批次按顺序写入
+        async with self._lock:
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines: List[str]):
+        text = "\n".join(lines) + "\n"
+        self._file.write(text)
+        self._file.flush()
+        if self.echo:
+            # 输出到 Docker 日志
+            sys.stdout.write(text)
+            sys.stdout.flush()
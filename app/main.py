@@ -1,12 +1,42 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
-from pydantic import BaseModel
-import subprocess, json, os
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+import json, os, socket, time
+from typing import Literal, Tuple
 import asyncio
-import requests
 
-app = FastAPI(title="Hot Trends Analyzer")
+import analyzer
+from ttl_cache import TTLCache
+from analysis_cache import AnalysisCache
+from result_store import ResultStore
+from model_catalog import ModelCatalog, ModelCatalogError, parse_keep_alive
+from snapshots import SnapshotStore
+from trend_index import TrendIndex
+from jobs import Job, JobManager
+from circuit_breaker import BreakerRegistry
+from shared_state import create_state
+from log_writer import BatchedLogWriter
+from scheduler import ReportScheduler
+import metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    JOB_MANAGER.start()
+    SCHEDULER.start()
+    if OLLAMA_WARMUP:
+        MODEL_CATALOG.warm(analyzer.get_http_client(), DEFAULT_MODEL)
+    yield
+    await SCHEDULER.stop()
+    await MODEL_CATALOG.stop()
+    await JOB_MANAGER.stop()
+    # 关闭分析流程共享的 HTTP 连接池
+    await analyzer.close_http_client()
+
+
+app = FastAPI(title="Hot Trends Analyzer", lifespan=lifespan)
 
 frontend_dir = "/app/frontend"
 assets_dir = os.path.join(frontend_dir, "assets")
@@ -27,7 +57,139 @@ async def serve_index():
 OLLAMA_API = os.getenv("OLLAMA_API", "http://localhost:11434")
 HOT_SEARCH_API = os.getenv("HOT_SEARCH_API", "http://localhost:8000/hot-search")
 DEFAULT_PLATFORMS = os.getenv("DEFAULT_PLATFORMS", "weibo,zhihu,baidu,douyin")
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "qwen2.5:14b")
 TOPICS_PER_PLATFORM = int(os.getenv("TOPICS_PER_PLATFORM", "10"))
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/app/outputs")
+# 热搜收集阶段的并发与时限
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "5"))
+PLATFORM_TIMEOUT = float(os.getenv("PLATFORM_TIMEOUT", "20"))
+COLLECT_TIMEOUT = float(os.getenv("COLLECT_TIMEOUT", "45"))
+# 熔断：某个上游（单个平台或 Ollama）连续失败 BREAKER_FAILURE_THRESHOLD 次后熔断 BREAKER_RESET_TIMEOUT 秒，
+# 期间直接跳过；之后放行一次试探请求，试探失败则熔断时间加倍，最长 BREAKER_MAX_RESET_TIMEOUT 秒
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+BREAKER_MAX_RESET_TIMEOUT = float(os.getenv("BREAKER_MAX_RESET_TIMEOUT", "300"))
+# 默认的整次运行时限（秒），0 表示不限；请求可通过 deadline 单独指定
+RUN_DEADLINE = float(os.getenv("RUN_DEADLINE", "0"))
+
+# 熔断器状态保存在各 worker 进程内，多 worker 部署时各自统计失败次数
+BREAKERS = BreakerRegistry(
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=BREAKER_RESET_TIMEOUT,
+    max_reset_timeout=BREAKER_MAX_RESET_TIMEOUT
+)
+metrics.Gauge("hot_trends_breakers_open", "处于熔断或试探状态的上游数", BREAKERS.open_count)
+
+# 热搜缓存：TTL 内直接命中，过期后在宽限期内先返回旧数据并后台刷新；缓存和并发请求的合并都只在 worker 进程内生效
+HOT_CACHE_TTL = float(os.getenv("HOT_CACHE_TTL", "180"))
+HOT_CACHE_STALE_TTL = float(os.getenv("HOT_CACHE_STALE_TTL", "120"))
+HOT_CACHE_MAX_ENTRIES = int(os.getenv("HOT_CACHE_MAX_ENTRIES", "256"))
+HOT_CACHE_MAX_BYTES = int(os.getenv("HOT_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+HOT_CACHE = TTLCache(
+    ttl=HOT_CACHE_TTL,
+    stale_ttl=HOT_CACHE_STALE_TTL,
+    max_entries=HOT_CACHE_MAX_ENTRIES,
+    max_bytes=HOT_CACHE_MAX_BYTES,
+    size_of=lambda titles: sum(len(t.encode("utf-8")) for t in titles) + 64 * len(titles)
+)
+
+# 模型分析缓存：持久化在 SQLite 中，多个 worker 共享
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", os.path.join(OUTPUT_DIR, "cache", "analysis_cache.db"))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "1800"))
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+ANALYSIS_CACHE = AnalysisCache(
+    path=ANALYSIS_CACHE_PATH,
+    ttl=ANALYSIS_CACHE_TTL,
+    max_bytes=ANALYSIS_CACHE_MAX_BYTES
+)
+
+# 结果存储：按运行 ID 保存结果与日志，超出保留条数/天数的旧运行会被清理
+RESULT_RETENTION_RUNS = int(os.getenv("RESULT_RETENTION_RUNS", "500"))
+RESULT_RETENTION_DAYS = float(os.getenv("RESULT_RETENTION_DAYS", "30"))
+
+RESULT_STORE = ResultStore(
+    root=OUTPUT_DIR,
+    max_runs=RESULT_RETENTION_RUNS,
+    max_age_days=RESULT_RETENTION_DAYS
+)
+
+# 同时执行的分析任务数，应与 Ollama 的并发承载能力匹配；配置了共享状态时是所有 worker 合计的上限。
+# 结束的任务保留一段时间供重新订阅
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "1"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "600"))
+# 每个任务保留的最近事件数，供重新连接的客户端回放
+JOB_REPLAY_EVENTS = int(os.getenv("JOB_REPLAY_EVENTS", "2000"))
+# 流式请求的客户端全部断开 ORPHAN_GRACE 秒后：cancel 取消任务，detach 让任务继续在后台执行
+ORPHAN_POLICY = os.getenv("ORPHAN_POLICY", "cancel")
+ORPHAN_GRACE = float(os.getenv("ORPHAN_GRACE", "30"))
+# 日志文件的批量写入间隔；SSE 空闲时发送心跳的间隔
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+
+# 多 worker 部署（WORKERS > 1，或多个副本）需要共享任务状态：sqlite 适用于同一台机器上的 worker 进程，
+# redis 可用于多台机器（需要安装 redis 包）；local 表示不共享，只适用于单 worker。
+# 共享状态只覆盖任务合并、事件、取消、分析并发槽位、定时任务租约和模型拉取；结果存储、分析缓存、
+# 热搜快照和历史索引仍是 OUTPUT_DIR 下的 SQLite 文件。redis 模式下多台机器必须挂载同一个 OUTPUT_DIR，
+# 且该卷要支持 SQLite 的文件锁（不要用 NFS/SMB 等网络文件系统），否则各副本的历史结果、缓存和增量基线互不相通
+WORKERS = int(os.getenv("WORKERS", "1"))
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite" if WORKERS > 1 else "local")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(OUTPUT_DIR, "state.db"))
+REDIS_URL = os.getenv("REDIS_URL", "")
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+# 执行方把任务事件同步到共享状态的间隔；心跳超过 WORKER_STALE_AFTER 秒的 worker 视为失联，其任务可被重新提交
+STATE_SYNC_INTERVAL = float(os.getenv("STATE_SYNC_INTERVAL", "0.25"))
+WORKER_STALE_AFTER = float(os.getenv("WORKER_STALE_AFTER", "30"))
+
+SHARED_STATE = create_state(STATE_BACKEND, path=STATE_DB_PATH, url=REDIS_URL,
+                            stale_after=WORKER_STALE_AFTER, retention=JOB_RETENTION)
+
+# 定时预计算：每隔 SCHEDULE_INTERVAL 秒用默认平台和默认模型生成一次报告，0 表示关闭
+SCHEDULE_INTERVAL = float(os.getenv("SCHEDULE_INTERVAL", "0"))
+SCHEDULE_INITIAL_DELAY = float(os.getenv("SCHEDULE_INITIAL_DELAY", "10"))
+
+# map-reduce 模式下同时进行的摘要调用数，应不超过 Ollama 的 OLLAMA_NUM_PARALLEL
+MAP_CONCURRENCY = int(os.getenv("MAP_CONCURRENCY", "2"))
+# 多模型对比时默认同时调用的模型数；Ollama 需能同时加载这些模型（OLLAMA_MAX_LOADED_MODELS）
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "2"))
+
+# 推理参数：num_ctx 按提示词估算长度自动选择，不超过 OLLAMA_MAX_CTX
+OLLAMA_TEMPERATURE = float(os.getenv("OLLAMA_TEMPERATURE", "0.7"))
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "2000"))
+OLLAMA_MAX_CTX = int(os.getenv("OLLAMA_MAX_CTX", "32768"))
+
+# 跨平台标题聚类的相似度阈值（字符二元组 Dice 系数）
+CLUSTER_THRESHOLD = float(os.getenv("CLUSTER_THRESHOLD", "0.6"))
+
+# 模型目录：/api/tags 结果的缓存时长；OLLAMA_KEEP_ALIVE 随每次调用传给 Ollama（如 30m；不带单位的数字按秒，-1 表示常驻），
+# OLLAMA_WARMUP 为 true 时启动后预热默认模型
+MODEL_CATALOG_TTL = float(os.getenv("MODEL_CATALOG_TTL", "30"))
+OLLAMA_KEEP_ALIVE = parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE"))
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "false").lower() in ("1", "true", "yes")
+
+# 多 worker 部署时模型拉取的租约和进度放在共享状态中，同一模型只拉取一次
+MODEL_CATALOG = ModelCatalog(OLLAMA_API, ttl=MODEL_CATALOG_TTL, keep_alive=OLLAMA_KEEP_ALIVE,
+                             state=SHARED_STATE, worker_id=WORKER_ID)
+
+# 热搜快照：每次运行保存各平台榜单，用于排名变化查询和增量分析
+SNAPSHOT_DB_PATH = os.getenv("SNAPSHOT_DB_PATH", os.path.join(OUTPUT_DIR, "snapshots.db"))
+SNAPSHOT_RETENTION_DAYS = float(os.getenv("SNAPSHOT_RETENTION_DAYS", "7"))
+# 增量分析：上一期报告超过 INCREMENTAL_MAX_AGE 秒、已连续增量 INCREMENTAL_MAX_CHAIN 次，
+# 或新上榜条目占比超过 INCREMENTAL_MAX_CHANGE 时改为完整分析
+INCREMENTAL_MAX_AGE = float(os.getenv("INCREMENTAL_MAX_AGE", "3600"))
+INCREMENTAL_MAX_CHAIN = int(os.getenv("INCREMENTAL_MAX_CHAIN", "5"))
+INCREMENTAL_MAX_CHANGE = float(os.getenv("INCREMENTAL_MAX_CHANGE", "0.5"))
+
+SNAPSHOT_STORE = SnapshotStore(SNAPSHOT_DB_PATH, max_age_days=SNAPSHOT_RETENTION_DAYS)
+
+# 热搜历史索引：同一话题在某平台两次出现间隔不超过 TREND_SPAN_GAP 秒视为连续在榜；
+# 逐次观测保留 TREND_RETENTION_DAYS 天，在榜区间长期保留
+TREND_INDEX_PATH = os.getenv("TREND_INDEX_PATH", os.path.join(OUTPUT_DIR, "trend_index.db"))
+TREND_SPAN_GAP = float(os.getenv("TREND_SPAN_GAP", "3600"))
+TREND_RETENTION_DAYS = float(os.getenv("TREND_RETENTION_DAYS", "180"))
+
+TREND_INDEX = TrendIndex(TREND_INDEX_PATH, span_gap=TREND_SPAN_GAP, retention_days=TREND_RETENTION_DAYS)
 
 
 @app.get("/api/config")
@@ -36,131 +198,258 @@ async def get_config():
         "ollama_api": OLLAMA_API,
         "hot_search_api": HOT_SEARCH_API,
         "default_platforms": DEFAULT_PLATFORMS,
+        "default_model": DEFAULT_MODEL,
         "topics_per_platform": TOPICS_PER_PLATFORM
     }
 
 
+@app.get("/api/breakers")
+async def get_breakers():
+    """各上游熔断器的状态：closed 正常，open 熔断中，half_open 等待试探"""
+    return BREAKERS.snapshot()
+
+
+@app.post("/api/breakers/{name:path}/reset")
+async def reset_breaker(name: str):
+    """手动关闭熔断器（如确认上游已恢复），名称形如 platform:weibo、ollama"""
+    breaker = BREAKERS.find(name)
+    if breaker is None:
+        raise HTTPException(status_code=404, detail="熔断器不存在")
+    breaker.reset()
+    return breaker.snapshot()
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """各缓存的命中/未命中统计"""
+    return {
+        "hot_search": HOT_CACHE.stats(),
+        "analysis": await asyncio.to_thread(ANALYSIS_CACHE.stats)
+    }
+
+
 @app.get("/api/ollama-models")
-async def get_ollama_models():
-    """获取 Ollama 服务器上已下载的模型列表"""
+async def get_ollama_models(refresh: bool = False):
+    """获取 Ollama 服务器上已下载的模型列表（短时缓存），附带后台拉取的进度"""
     try:
-        response = requests.get(f"{OLLAMA_API}/api/tags", timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            models = []
-            for model in data.get("models", []):
-                model_name = model.get("name", "")
-                if model_name:
-                    models.append({
-                        "name": model_name,
-                        "size": model.get("size", 0),
-                        "modified_at": model.get("modified_at", "")
-                    })
-            return {
-                "success": True,
-                "models": models
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"Ollama API 返回错误: {response.status_code}",
-                "models": []
-            }
-    except requests.exceptions.RequestException as e:
+        models = await MODEL_CATALOG.list_models(analyzer.get_http_client(), refresh=refresh)
+    except ModelCatalogError as e:
         return {
             "success": False,
-            "error": f"无法连接到 Ollama 服务: {str(e)}",
+            "error": str(e),
             "models": []
         }
+    return {
+        "success": True,
+        "models": models,
+        "pulls": list(MODEL_CATALOG.pulls.values())
+    }
+
+
+class ModelRequest(BaseModel):
+    name: str
+
+
+@app.post("/api/ollama-models/pull", status_code=202)
+async def pull_ollama_model(req: ModelRequest):
+    """在后台拉取模型，立即返回当前进度"""
+    return await MODEL_CATALOG.pull(analyzer.get_http_client(), req.name)
+
+
+@app.get("/api/ollama-models/pulls")
+async def get_model_pulls():
+    """本 worker 发起的各模型后台拉取进度；多 worker 部署时按模型名查询可看到其他 worker 的拉取"""
+    return MODEL_CATALOG.stats()
+
+
+@app.get("/api/ollama-models/pulls/{model_name:path}")
+async def get_model_pull(model_name: str):
+    status = await MODEL_CATALOG.get_pull(model_name)
+    if status is None:
+        raise HTTPException(status_code=404, detail="没有该模型的拉取记录")
+    return status
+
+
+@app.post("/api/ollama-models/warm", status_code=202)
+async def warm_ollama_model(req: ModelRequest):
+    """在后台预热模型，使下一次分析不必等待模型加载"""
+    MODEL_CATALOG.warm(analyzer.get_http_client(), req.name)
+    return {"model": req.name, "keep_alive": MODEL_CATALOG.keep_alive}
 
 
 class AnalysisRequest(BaseModel):
-    ollama_model: str = "qwen2.5:14b"
+    ollama_model: str = DEFAULT_MODEL
     topics_per_platform: int = None
-    platforms: list[str] = [
-        "weibo", "zhihu", "baidu", "douyin"
-    ]
+    # 与定时预计算使用同一份默认平台，默认参数的请求才能命中预计算的报告
+    platforms: list[str] = Field(default_factory=lambda: DEFAULT_PLATFORMS.split(","), min_length=1)
+    use_cache: bool = True  # 为 False 时忽略已缓存的分析结果，强制重新调用模型
+    max_age: float = None  # 可接受的预计算报告最大时长（秒），不指定时总是重新分析
+    # map_reduce：先分平台并发概括，再汇总成报告；incremental：只提交上一期报告和此后的榜单变化
+    mode: Literal["single", "map_reduce", "incremental"] = "single"
+    map_batch_size: int = 1  # map_reduce 模式下每次摘要调用包含的平台数
+    dedupe: bool = True  # 构建提示词前对跨平台的相似标题聚类去重
+    # 多模型对比：指定时忽略 ollama_model，共用一次数据收集和同一份提示词并发调用各模型（仅 single 模式）
+    models: list[str] = None
+    model_concurrency: int = None  # 同时调用的模型数，默认 MODEL_CONCURRENCY
+    policy: Literal["all", "first"] = "all"  # first：以最先成功的模型作为结果返回，并取消其余模型
+    # 整次运行的时限（秒），默认 RUN_DEADLINE；到时模型仍未完成则返回标记为 partial 的部分报告
+    deadline: float = Field(None, gt=0)
+
+
+def build_config(req: AnalysisRequest) -> analyzer.AnalysisConfig:
+    """把请求参数转换为分析配置，未指定的项使用环境变量作为默认值"""
+    topics_count = req.topics_per_platform if req.topics_per_platform is not None else TOPICS_PER_PLATFORM
+    models = list(dict.fromkeys(req.models or []))
+    return analyzer.AnalysisConfig(
+        hot_search_api=HOT_SEARCH_API,
+        ollama_api=OLLAMA_API,
+        ollama_model=models[0] if models else req.ollama_model,
+        save_dir=OUTPUT_DIR,
+        platforms=req.platforms,
+        topics_per_platform=topics_count,
+        fetch_concurrency=FETCH_CONCURRENCY,
+        platform_timeout=PLATFORM_TIMEOUT,
+        collect_timeout=COLLECT_TIMEOUT,
+        hot_cache=HOT_CACHE,
+        analysis_cache=ANALYSIS_CACHE if req.use_cache else None,
+        result_store=RESULT_STORE,
+        analysis_mode=req.mode,
+        map_batch_size=req.map_batch_size,
+        map_concurrency=MAP_CONCURRENCY,
+        dedupe=req.dedupe,
+        cluster_threshold=CLUSTER_THRESHOLD,
+        temperature=OLLAMA_TEMPERATURE,
+        num_predict=OLLAMA_NUM_PREDICT,
+        max_ctx=OLLAMA_MAX_CTX,
+        model_catalog=MODEL_CATALOG,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        snapshot_store=SNAPSHOT_STORE,
+        incremental_max_age=INCREMENTAL_MAX_AGE,
+        incremental_max_chain=INCREMENTAL_MAX_CHAIN,
+        incremental_max_change=INCREMENTAL_MAX_CHANGE,
+        trend_index=TREND_INDEX,
+        compare_models=models,
+        model_concurrency=req.model_concurrency or MODEL_CONCURRENCY,
+        fanout_policy=req.policy,
+        breakers=BREAKERS,
+        deadline=req.deadline or RUN_DEADLINE or None
+    )
 
 
-async def stream_logs(cmd: list, save_dir: str):
-    """流式输出日志的生成器"""
-    log_file_path = os.path.join(save_dir, "run.log")
-    
+async def run_events(config: analyzer.AnalysisConfig):
+    """在当前事件循环内运行分析流程，逐个产出事件；日志批量写入本次运行的日志文件和标准输出"""
+    model = ",".join(config.compare_models) or config.ollama_model
+    config.run_id = await asyncio.to_thread(RESULT_STORE.start_run, model, config.platforms)
+    log_file_path = RESULT_STORE.log_path(config.run_id)
+    queue = asyncio.Queue()
+    task = asyncio.create_task(analyzer.run_pipeline(config, queue))
+
     try:
-        with open(log_file_path, "w", encoding="utf-8") as log_file:
-            # 添加环境变量强制 Python 不缓冲输出
-            env = os.environ.copy()
-            env['PYTHONUNBUFFERED'] = '1'
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                env=env
-            )
-            
-            # 实时读取并发送日志
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    line = line.rstrip()
-                    print(line, flush=True)  # 输出到 Docker 日志
-                    log_file.write(line + "\n")
-                    log_file.flush()
-                    
-                    # 发送 SSE 格式的日志
-                    yield f"data: {json.dumps({'type': 'log', 'message': line})}\n\n"
-                    await asyncio.sleep(0)  # 让出控制权
-            
-            process.stdout.close()
-            returncode = process.wait()
-            
-            if returncode != 0:
-                error_msg = f"Analyzer 执行失败，退出码: {returncode}，日志见 {log_file_path}"
-                yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
-                return
-            
-            # 查找生成的结果文件
-            files = [f for f in os.listdir(save_dir) if f.endswith(".json")]
-            if not files:
-                error_msg = f"未生成分析结果，日志见 {log_file_path}"
-                yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
-                return
-            
-            result_file = os.path.join(save_dir, files[0])
-            with open(result_file, "r", encoding="utf-8") as f:
-                result_data = json.load(f)
-            
-            # 发送完成信号和结果
-            yield f"data: {json.dumps({'type': 'complete', 'result': result_data})}\n\n"
-            
-    except Exception as e:
-        error_msg = f"执行出错: {str(e)}"
-        yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
+        async with BatchedLogWriter(log_file_path, flush_interval=LOG_FLUSH_INTERVAL) as log_writer:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
 
+                if event["type"] == "log":
+                    log_writer.write(event["message"])
+                elif event["type"] == "error":
+                    await asyncio.to_thread(RESULT_STORE.fail, config.run_id, event["message"])
+                    event = {"type": "error", "message": f"{event['message']}，日志见 {log_file_path}"}
 
-@app.post("/api/analyze-stream")
-async def analyze_stream(req: AnalysisRequest):
-    """流式分析接口，使用 SSE 实时返回日志"""
-    save_dir = "/app/outputs"
-    os.makedirs(save_dir, exist_ok=True)
-    
-    # 使用环境变量作为默认值
-    topics_count = req.topics_per_platform if req.topics_per_platform is not None else TOPICS_PER_PLATFORM
+                yield event
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.to_thread(RESULT_STORE.fail, config.run_id, "运行被中断")
 
-    cmd = [
-        "python", "/app/analyzer.py",
-        "--hot-search-api", HOT_SEARCH_API,
-        "--ollama-api", OLLAMA_API,
-        "--ollama-model", req.ollama_model,
-        "--save-dir", save_dir,
-        "--topics-per-platform", str(topics_count)
-    ]
-    cmd += ["--platforms"] + req.platforms
 
+async def execute_job(job: Job):
+    """任务执行入口：运行分析流程并把事件发布给任务的所有订阅者"""
+    async for event in run_events(job.config):
+        job.publish(event)
+        if event["type"] == "complete" and not event["result"]["partial"]:
+            await SCHEDULER.record(job.key, event["result"])
+
+
+JOB_MANAGER = JobManager(execute_job, concurrency=ANALYSIS_CONCURRENCY, retention=JOB_RETENTION,
+                         replay_limit=JOB_REPLAY_EVENTS, orphan_policy=ORPHAN_POLICY, orphan_grace=ORPHAN_GRACE,
+                         state=SHARED_STATE, worker_id=WORKER_ID, sync_interval=STATE_SYNC_INTERVAL)
+
+
+def job_key(config: analyzer.AnalysisConfig) -> Tuple:
+    key = (config.ollama_model, tuple(config.platforms), config.topics_per_platform)
+    if config.analysis_mode != "single":
+        # 不同模式的报告不能互相合并或替代
+        key += (config.analysis_mode, config.map_batch_size)
+    if not config.dedupe:
+        key += ("no-dedupe",)
+    if config.compare_models:
+        key += ("compare", tuple(config.compare_models), config.fanout_policy)
+    if config.deadline:
+        # 有时限的运行可能只得到部分报告，不能与其他时限的运行合并
+        key += ("deadline", config.deadline)
+    return key
+
+
+async def submit_job(req: AnalysisRequest, cancel_when_orphaned: bool = False) -> Tuple[Job, bool]:
+    """提交分析任务，(模型, 平台, 条数) 相同的进行中任务会被合并（启用共享状态时跨 worker 合并）"""
+    if req.models and req.mode != "single":
+        raise HTTPException(status_code=400, detail="多模型对比只支持 single 模式")
+    config = build_config(req)
+    return await JOB_MANAGER.submit(job_key(config), config, cancel_when_orphaned)
+
+
+async def submit_scheduled() -> Job:
+    job, _ = await submit_job(default_request())
+    return job
+
+
+def default_request() -> AnalysisRequest:
+    return AnalysisRequest()
+
+
+metrics.Gauge("hot_trends_jobs_queued", "排队中的分析任务数", lambda: JOB_MANAGER.stats()["queued"])
+metrics.Gauge("hot_trends_jobs_running", "执行中的分析任务数", lambda: JOB_MANAGER.stats()["running"])
+
+
+SCHEDULER = ReportScheduler(
+    submit=submit_scheduled,
+    key=job_key(build_config(default_request())),
+    interval=SCHEDULE_INTERVAL,
+    initial_delay=SCHEDULE_INITIAL_DELAY,
+    state=SHARED_STATE,
+    worker_id=WORKER_ID
+)
+
+
+def sse_frame(event: dict, event_id: int = None) -> str:
+    frame = f"id: {event_id}\n" if event_id is not None else ""
+    return frame + f"data: {json.dumps(event)}\n\n"
+
+
+async def stream_logs(job: Job, coalesced: bool = False, last_event_id: int = 0):
+    """流式输出日志的生成器：先告知任务 ID，再回放并实时推送 last_event_id 之后的任务事件
+
+    事件带 SSE id，客户端断线后可凭 Last-Event-ID 从断点继续；同一批可读的事件合并为一次写出。
+    """
+    if not last_event_id:
+        yield sse_frame({'type': 'job', 'job_id': job.id, 'coalesced': coalesced})
+    try:
+        async for batch in job.subscribe(last_event_id, heartbeat=SSE_HEARTBEAT):
+            if not batch:
+                # SSE 注释行作为心跳，防止代理断开空闲连接，也让断开的连接尽早暴露
+                yield ": keep-alive\n\n"
+                continue
+            yield "".join(sse_frame(event, event_id) for event_id, event in batch)
+    except Exception as e:
+        error_msg = f"执行出错: {str(e)}"
+        yield sse_frame({'type': 'error', 'message': error_msg})
+
+
+def sse_response(generator) -> StreamingResponse:
     return StreamingResponse(
-        stream_logs(cmd, save_dir),
+        generator,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -170,49 +459,138 @@ async def analyze_stream(req: AnalysisRequest):
     )
 
 
+@app.post("/api/analyze-stream")
+async def analyze_stream(req: AnalysisRequest):
+    """流式分析接口，使用 SSE 实时返回日志；客户端全部断开后按 ORPHAN_POLICY 处理任务"""
+    job, coalesced = await submit_job(req, cancel_when_orphaned=True)
+    return sse_response(stream_logs(job, coalesced))
+
+
 @app.post("/api/analyze")
 async def analyze(req: AnalysisRequest):
-    """保留原有的非流式接口作为备用"""
-    save_dir = "/app/outputs"
-    os.makedirs(save_dir, exist_ok=True)
-    
-    # 使用环境变量作为默认值
-    topics_count = req.topics_per_platform if req.topics_per_platform is not None else TOPICS_PER_PLATFORM
+    """非流式接口；指定 max_age 时，若预计算报告足够新则直接返回"""
+    if req.max_age is not None:
+        report = await SCHEDULER.fresh(job_key(build_config(req)), req.max_age)
+        if report is not None:
+            return {**report, "precomputed": True, "age_seconds": SCHEDULER.age()}
+
+    job, _ = await submit_job(req)
+    await job.wait()
+    if job.result is None:
+        raise HTTPException(status_code=500, detail=job.error or "未生成分析结果")
+    return job.result
+
+
+@app.get("/api/jobs")
+async def get_jobs():
+    """任务队列与定时预计算概况"""
+    return {**JOB_MANAGER.stats(), "scheduler": SCHEDULER.stats()}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询任务状态"""
+    job = await JOB_MANAGER.lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job.summary()
 
-    cmd = [
-        "python", "/app/analyzer.py",
-        "--hot-search-api", HOT_SEARCH_API,
-        "--ollama-api", OLLAMA_API,
-        "--ollama-model", req.ollama_model,
-        "--save-dir", save_dir,
-        "--topics-per-platform", str(topics_count)
-    ]
-    cmd += ["--platforms"] + req.platforms
 
+@app.get("/api/jobs/{job_id}/stream")
+async def reattach_job(job_id: str, last_event_id: str = Header(None, alias="Last-Event-ID")):
+    """按任务 ID 重新订阅事件流：带 Last-Event-ID 时从该事件之后继续，否则回放缓冲区内的全部事件"""
+    job = await JOB_MANAGER.lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
     try:
-        log_file_path = os.path.join(save_dir, "run.log")
-        with open(log_file_path, "w", encoding="utf-8") as log_file:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True
-            )
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    print(line.strip(), flush=True)
-                    log_file.write(line)
-            process.stdout.close()
-            returncode = process.wait()
-
-        if returncode != 0:
-            raise HTTPException(status_code=500, detail=f"Analyzer 执行失败，日志见 {log_file_path}")
-
-        files = [f for f in os.listdir(save_dir) if f.endswith(".json")]
-        if not files:
-            raise HTTPException(status_code=500, detail=f"未生成分析结果，日志见 {log_file_path}")
-        result_file = os.path.join(save_dir, files[0])
-        with open(result_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=500, detail=f"Analyzer 执行失败，日志见 {log_file_path}")
\ No newline at end of file
+        resume_from = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID 无效")
+    return sse_response(stream_logs(job, last_event_id=resume_from))
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消排队中或执行中的任务"""
+    job = await JOB_MANAGER.lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    await JOB_MANAGER.request_cancel(job)
+    return job.summary()
+
+
+@app.get("/api/results")
+async def list_results(limit: int = Query(20, ge=1, le=200), offset: int = Query(0, ge=0),
+                       status: str = None):
+    """按时间倒序分页列出历史运行"""
+    return await asyncio.to_thread(RESULT_STORE.list, limit, offset, status)
+
+
+@app.get("/api/results/{run_id}")
+async def get_result(run_id: str):
+    """获取指定运行的分析结果"""
+    run = await asyncio.to_thread(RESULT_STORE.get_run, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="运行记录不存在")
+    if run["status"] not in ("complete", "partial"):
+        return run
+    result = await asyncio.to_thread(RESULT_STORE.load, run_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="结果文件不存在")
+    return result
+
+
+@app.get("/api/trends/movements")
+async def get_movements(platforms: str = None, window: float = Query(None, gt=0)):
+    """各平台最新榜单相对上一份快照（或 window 秒之前的快照）的新上榜、落榜和排名变化
+
+    platforms 为逗号分隔的平台列表，不指定时返回所有有快照的平台。
+    """
+    names = platforms.split(",") if platforms else await asyncio.to_thread(SNAPSHOT_STORE.platforms)
+    movements = {}
+    for name in names:
+        result = await asyncio.to_thread(SNAPSHOT_STORE.movements, name, window)
+        if result is not None:
+            movements[name] = result
+    return movements
+
+
+@app.get("/api/history/top")
+async def get_history_top(days: float = Query(7, gt=0), limit: int = Query(20, ge=1, le=200),
+                          platform: str = None, max_rank: int = Query(None, ge=1)):
+    """最近 days 天覆盖平台最多、在榜最久的话题"""
+    until = time.time()
+    return await asyncio.to_thread(TREND_INDEX.top, until - days * 86400, until, limit, platform, max_rank)
+
+
+@app.get("/api/history/search")
+async def search_history(q: str = Query(..., min_length=1), limit: int = Query(20, ge=1, le=200),
+                         days: float = Query(None, gt=0)):
+    """按标题全文搜索历史话题"""
+    since = time.time() - days * 86400 if days else None
+    return await asyncio.to_thread(TREND_INDEX.search, q, limit, since)
+
+
+@app.get("/api/history/topic")
+async def get_topic_lifetime(title: str = None, topic_id: int = None, top_n: int = Query(None, ge=1),
+                             series: bool = False):
+    """话题在各平台的在榜历史；指定 top_n 时统计处于前 top_n 名的累计时长"""
+    if topic_id is None:
+        if not title:
+            raise HTTPException(status_code=400, detail="需要 title 或 topic_id")
+        topic_id = await asyncio.to_thread(TREND_INDEX.find_topic, title)
+    result = await asyncio.to_thread(TREND_INDEX.lifetime, topic_id, top_n, series) if topic_id else None
+    if result is None:
+        raise HTTPException(status_code=404, detail="没有找到该话题")
+    return result
+
+
+@app.get("/api/history/stats")
+async def get_history_stats():
+    return await asyncio.to_thread(TREND_INDEX.stats)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus 格式的运行指标"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
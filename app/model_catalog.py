@@ -0,0 +1,248 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import httpx
+
+from ttl_cache import TTLCache
+
+
+class ModelCatalogError(Exception):
+    pass
+
+
+# Ollama 按 Go 的 time.ParseDuration 解析字符串形式的 keep_alive，每一段都必须带单位
+_DURATION = re.compile(r"-?(\d+(\.\d*)?|\.\d+)(ns|us|µs|ms|s|m|h)((\d+(\.\d*)?|\.\d+)(ns|us|µs|ms|s|m|h))*")
+
+
+def parse_keep_alive(value: Optional[str]) -> Optional[Union[str, float]]:
+    """把配置的 keep_alive 转换为 Ollama 接受的形式
+
+    不带单位的数字按秒以数值发送（-1 表示常驻），带单位的时长（如 30m、1h30m）原样发送，其他写法抛出 ModelCatalogError。
+    """
+    if value is None or not value.strip():
+        return None
+    value = value.strip()
+    if _DURATION.fullmatch(value):
+        return value
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is None or number != number or abs(number) == float("inf"):
+        raise ModelCatalogError(f"无效的 keep_alive: {value}，应为秒数（如 -1、300）或带单位的时长（如 30m）")
+    return int(number) if number.is_integer() else number
+
+
+class ModelCatalog:
+    """Ollama 模型目录
+
+    - /api/tags 的结果短时缓存，模型列表接口和分析前的模型检查共用，并发查询合并为一次请求
+    - 缺失的模型在后台拉取，进度可随时查询；任何请求都不会等待拉取完成
+    - 可选预热：提前把模型加载进显存，并通过 keep_alive 控制其常驻时长
+    - 配置了共享状态时，同一模型只由持有租约的一个 worker 拉取，进度写入共享状态，任何 worker 都能按模型名查询；
+      拉取进度列表（pulls / stats）只包含本 worker 发起的拉取
+    """
+
+    # 拉取租约的时长，拉取期间随进度续期；持有者退出后最多这么久由其他 worker 接手
+    pull_lease_ttl = 120
+    # 拉取结束后共享状态中保留进度的时长
+    pull_status_ttl = 3600
+
+    def __init__(self, ollama_api: str, ttl: float = 30, keep_alive: Optional[Union[str, float]] = None,
+                 state: Any = None, worker_id: str = ""):
+        self.ollama_api = ollama_api
+        self.keep_alive = keep_alive
+        self.state = state
+        self.worker_id = worker_id
+        self.last_error: Optional[str] = None
+        self.pulls: Dict[str, Dict] = {}
+        self.warmed: Dict[str, Dict] = {}
+        self._cache = TTLCache(ttl=ttl, max_entries=4)
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    async def _fetch(self, client: httpx.AsyncClient) -> Optional[List[Dict]]:
+        try:
+            response = await client.get(f"{self.ollama_api}/api/tags", timeout=5)
+        except httpx.HTTPError as e:
+            self.last_error = f"无法连接到 Ollama 服务: {e}"
+            return None
+        if response.status_code != 200:
+            self.last_error = f"Ollama API 返回错误: {response.status_code}"
+            return None
+        self.last_error = None
+        return [
+            {
+                "name": model["name"],
+                "size": model.get("size", 0),
+                "modified_at": model.get("modified_at", "")
+            }
+            for model in response.json().get("models", []) if model.get("name")
+        ]
+
+    async def list_models(self, client: httpx.AsyncClient, refresh: bool = False) -> List[Dict]:
+        """返回已下载的模型列表；refresh 为 True 时跳过缓存"""
+        if refresh:
+            self._cache.invalidate(self.ollama_api)
+        result = await self._cache.get(self.ollama_api, lambda: self._fetch(client))
+        if result.value is None:
+            raise ModelCatalogError(self.last_error or "获取模型列表失败")
+        return result.value
+
+    async def has_model(self, client: httpx.AsyncClient, model_name: str) -> bool:
+        return any(m["name"] == model_name for m in await self.list_models(client))
+
+    async def ensure(self, client: httpx.AsyncClient, model_name: str, log: Callable[[str], None]) -> bool:
+        """分析前检查模型：已存在返回 True；不存在时在后台开始拉取并返回 False，不等待拉取"""
+        try:
+            if await self.has_model(client, model_name):
+                log(f"✅ 模型已存在: {model_name}")
+                return True
+        except ModelCatalogError as e:
+            log(f"❌ 检查模型时出错: {e}")
+            return False
+
+        status = await self.pull(client, model_name)
+        progress = f"，进度 {status['progress']}%" if status.get("progress") is not None else ""
+        log(f"📦 模型不存在，已在后台拉取: {model_name}{progress}，拉取完成后请重新提交分析")
+        return False
+
+    async def pull(self, client: httpx.AsyncClient, model_name: str) -> Dict:
+        """在后台拉取模型并返回进度；同一模型正在拉取（包括在其他 worker 上）时直接返回已有进度"""
+        task = self._tasks.get(f"pull:{model_name}")
+        if task is not None and not task.done():
+            return self.pulls[model_name]
+        if self.state is not None and not await asyncio.to_thread(
+                self.state.acquire_lease, f"pull:{model_name}", self.worker_id, self.pull_lease_ttl):
+            status = await self.get_pull(model_name)
+            if status is not None:
+                return status
+            return {"model": model_name, "status": "pulling", "detail": "其他 worker 正在拉取", "worker": None}
+
+        self.pulls[model_name] = {
+            "model": model_name,
+            "status": "pulling",
+            "detail": None,
+            "completed": None,
+            "total": None,
+            "progress": None,
+            "error": None,
+            "started_at": time.time(),
+            "finished_at": None,
+            "worker": self.worker_id
+        }
+        await self._publish(model_name)
+        self._spawn(f"pull:{model_name}", self._pull(client, model_name))
+        return self.pulls[model_name]
+
+    async def get_pull(self, model_name: str) -> Optional[Dict]:
+        """查询模型的拉取进度：先查本 worker，配置了共享状态时再查其他 worker 发起的拉取"""
+        status = self.pulls.get(model_name)
+        if status is not None or self.state is None:
+            return status
+        return await asyncio.to_thread(self.state.get_value, f"pull:{model_name}")
+
+    async def _publish(self, model_name: str):
+        """把本 worker 的拉取进度写入共享状态；拉取中时同时续期租约"""
+        if self.state is None:
+            return
+        status = self.pulls[model_name]
+        finished = status["status"] != "pulling"
+        try:
+            await asyncio.to_thread(self.state.put_value, f"pull:{model_name}", status,
+                                    self.pull_status_ttl if finished else self.pull_lease_ttl)
+            if not finished:
+                await asyncio.to_thread(self.state.acquire_lease, f"pull:{model_name}", self.worker_id,
+                                        self.pull_lease_ttl)
+        except Exception as e:
+            print(f"⚠️ 同步模型拉取进度失败: {model_name}: {e}", flush=True)
+
+    def _spawn(self, name: str, coro):
+        task = asyncio.create_task(coro)
+        self._tasks[name] = task
+        task.add_done_callback(lambda t: self._tasks.pop(name, None) if self._tasks.get(name) is t else None)
+
+    async def _pull(self, client: httpx.AsyncClient, model_name: str):
+        status = self.pulls[model_name]
+        print(f"📦 开始后台拉取模型: {model_name}", flush=True)
+        published_at = time.monotonic()
+        try:
+            async with client.stream("POST", f"{self.ollama_api}/api/pull", json={"name": model_name},
+                                     timeout=httpx.Timeout(600, connect=10)) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        msg = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if msg.get("error"):
+                        raise ModelCatalogError(msg["error"])
+                    status["detail"] = msg.get("status") or status["detail"]
+                    if msg.get("total"):
+                        status["completed"] = msg.get("completed", 0)
+                        status["total"] = msg["total"]
+                        status["progress"] = round(status["completed"] / status["total"] * 100, 1)
+                    if time.monotonic() - published_at >= 1:
+                        published_at = time.monotonic()
+                        await self._publish(model_name)
+            status["status"] = "success"
+            status["progress"] = 100.0
+            print(f"✅ 模型拉取完成: {model_name}", flush=True)
+        except Exception as e:
+            status["status"] = "failed"
+            status["error"] = str(e)
+            print(f"❌ 模型拉取失败: {model_name}: {e}", flush=True)
+        finally:
+            status["finished_at"] = time.time()
+            self._cache.invalidate(self.ollama_api)
+            await self._publish(model_name)
+
+    def warm(self, client: httpx.AsyncClient, model_name: str):
+        """在后台预热模型；模型不存在时先拉取"""
+        task = self._tasks.get(f"warm:{model_name}")
+        if task is None or task.done():
+            self._spawn(f"warm:{model_name}", self._warm(client, model_name))
+
+    async def _warm(self, client: httpx.AsyncClient, model_name: str):
+        try:
+            if not await self.has_model(client, model_name):
+                status = await self.pull(client, model_name)
+                # 拉取可能在其他 worker 上进行，统一按进度等待其结束
+                while status is not None and status["status"] == "pulling":
+                    await asyncio.sleep(2)
+                    status = await self.get_pull(model_name)
+                if status is None or status["status"] != "success":
+                    return
+                self._cache.invalidate(self.ollama_api)
+
+            # 不带 prompt 的 generate 请求只加载模型，keep_alive 决定加载后常驻多久
+            payload = {"model": model_name}
+            if self.keep_alive is not None:
+                payload["keep_alive"] = self.keep_alive
+            started = time.perf_counter()
+            response = await client.post(f"{self.ollama_api}/api/generate", json=payload,
+                                         timeout=httpx.Timeout(300, connect=10))
+            response.raise_for_status()
+            load_seconds = round(time.perf_counter() - started, 2)
+            self.warmed[model_name] = {"at": time.time(), "load_seconds": load_seconds}
+            print(f"🔥 模型预热完成: {model_name}（{load_seconds} 秒）", flush=True)
+        except Exception as e:
+            print(f"⚠️ 模型预热失败: {model_name}: {e}", flush=True)
+
+    def stats(self) -> Dict:
+        return {
+            "cache": self._cache.stats(),
+            "keep_alive": self.keep_alive,
+            "pulls": list(self.pulls.values()),
+            "warmed": self.warmed
+        }
@@ -0,0 +1,234 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from clustering import format_clusters
+
+# DailyHotApi 调用名称 -> (站点名称, 榜单类别)。提示词中直接使用站点名称，模型不会看到调用名称
+PLATFORM_NAMES = {
+    "bilibili": ("哔哩哔哩", "热门榜"),
+    "acfun": ("AcFun", "排行榜"),
+    "weibo": ("微博", "热搜榜"),
+    "zhihu": ("知乎", "热榜"),
+    "zhihu-daily": ("知乎日报", "推荐榜"),
+    "baidu": ("百度", "热搜榜"),
+    "douyin": ("抖音", "热点榜"),
+    "kuaishou": ("快手", "热点榜"),
+    "douban-movie": ("豆瓣电影", "新片榜"),
+    "douban-group": ("豆瓣讨论小组", "讨论精选"),
+    "tieba": ("百度贴吧", "热议榜"),
+    "sspai": ("少数派", "热榜"),
+    "ithome": ("IT之家", "热榜"),
+    "ithome-xijiayi": ("IT之家「喜加一」", "最新动态"),
+    "jianshu": ("简书", "热门推荐"),
+    "guokr": ("果壳", "热门文章"),
+    "thepaper": ("澎湃新闻", "热榜"),
+    "toutiao": ("今日头条", "热榜"),
+    "36kr": ("36 氪", "热榜"),
+    "51cto": ("51CTO", "推荐榜"),
+    "csdn": ("CSDN", "排行榜"),
+    "nodeseek": ("NodeSeek", "最新动态"),
+    "juejin": ("稀土掘金", "热榜"),
+    "qq-news": ("腾讯新闻", "热点榜"),
+    "sina": ("新浪网", "热榜"),
+    "sina-news": ("新浪新闻", "热点榜"),
+    "netease-news": ("网易新闻", "热点榜"),
+    "52pojie": ("吾爱破解", "榜单"),
+    "hostloc": ("全球主机交流", "榜单"),
+    "huxiu": ("虎嗅", "24小时"),
+    "coolapk": ("酷安", "热榜"),
+    "hupu": ("虎扑", "步行街热帖"),
+    "ifanr": ("爱范儿", "快讯"),
+    "lol": ("英雄联盟", "更新公告"),
+    "miyoushe": ("米游社", "最新消息"),
+    "genshin": ("原神", "最新消息"),
+    "honkai": ("崩坏3", "最新动态"),
+    "starrail": ("崩坏：星穹铁道", "最新动态"),
+    "weread": ("微信读书", "飙升榜"),
+    "ngabbs": ("NGA", "热帖"),
+    "v2ex": ("V2EX", "主题榜"),
+    "hellogithub": ("HelloGitHub", "Trending"),
+    "weatheralarm": ("中央气象台", "全国气象预警"),
+    "earthquake": ("中国地震台", "地震速报"),
+    "history": ("历史上的今天", "月-日"),
+    "github": ("GitHub", "Trending"),
+    "hackernews": ("Hacker News", "热门"),
+}
+
+# 固定的系统提示词：每次运行完全相同，Ollama 可以复用这段前缀的 KV 缓存
+REPORT_SYSTEM_PROMPT = """你是一名网络热点分析师，需要根据用户提供的多平台热搜数据，写一篇流畅的总结报告，描述当前网络热门趋势。
+
+要求：
+- 用自然流畅的段落形式写作，不要使用分点列表或标题
+- 要将趋势分析和具体事实有机结合，尤其要明确指出信源哪个平台、原始内容是什么
+- 被多个平台提到的内容重点分析
+- 在文末列举出被全网所关注的原始内容
+- 全文控制在300-500字，语言专业但易读
+- 平台一律使用数据中给出的站点名称
+
+请用中文撰写这篇总结。"""
+
+MAP_SYSTEM_PROMPT = """你需要阅读用户提供的一个或几个平台的热搜数据，为每个平台分别写一段不超过150字的摘要，供后续汇总使用。
+
+要求：
+- 每段以平台站点名称开头，例如"微博："
+- 概括该平台当前最主要的几类热点，并原文引用最重要的3-5条热搜标题
+- 只陈述事实，不要评论或推测"""
+
+# 各类调用的输出 token 预算
+REPORT_NUM_PREDICT = 2000
+MAP_NUM_PREDICT_PER_PLATFORM = 300
+MAP_TEMPERATURE = 0.3
+
+# num_ctx 只在这几档之间取值：Ollama 在 num_ctx 变化时会重新加载模型，分档可避免频繁重载
+CONTEXT_BUCKETS = (4096, 8192, 16384, 32768)
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+@dataclass
+class Prompt:
+    """一次模型调用的提示词：固定的系统消息 + 每次运行变化的用户消息"""
+    system: str
+    user: str
+
+    def messages(self) -> List[Dict]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user}
+        ]
+
+    def text(self) -> str:
+        """拼接后的完整文本，用于缓存键和日志"""
+        return f"{self.system}\n\n{self.user}"
+
+
+def display_name(platform: str) -> str:
+    return PLATFORM_NAMES.get(platform, (platform, ""))[0]
+
+
+def platform_label(platform: str) -> str:
+    site, category = PLATFORM_NAMES.get(platform, (platform, ""))
+    return f"{site}·{category}" if category else site
+
+
+def format_topics(all_topics: Dict[str, List[str]]) -> str:
+    """把各平台热搜排成带序号的文本，平台以站点名称标注"""
+    topics_text = ""
+    for platform, topics in all_topics.items():
+        topics_text += f"\n【{platform_label(platform)}】\n"
+        for i, topic in enumerate(topics, 1):
+            topics_text += f"{i}. {topic}\n"
+    return topics_text
+
+
+def build_prompt(all_topics: Dict[str, List[str]], clusters: Optional[List[Dict]] = None) -> Prompt:
+    """根据各平台热搜构建报告提示词；提供聚类结果时，跨平台热点合并列出"""
+    if clusters is not None:
+        topics_text = format_clusters(clusters, list(all_topics.keys()),
+                                      label=platform_label, source=display_name)
+    else:
+        topics_text = format_topics(all_topics)
+    return Prompt(REPORT_SYSTEM_PROMPT, f"以下是来自多个平台的热搜数据：\n{topics_text}")
+
+
+def build_reduce_prompt(summaries: Dict[Tuple[str, ...], str], clusters: Optional[List[Dict]] = None) -> Prompt:
+    """map-reduce 模式的汇总提示词：输入为各平台批次的摘要，以及跨平台共同热点"""
+    topics_text = ""
+    shared = [c for c in clusters or [] if len(c["platforms"]) > 1]
+    if shared:
+        topics_text += "\n【多平台共同热点】\n"
+        for i, cluster in enumerate(shared, 1):
+            sources = "、".join(display_name(p) for p in cluster["platforms"])
+            topics_text += f"{i}. {cluster['title']}（来源：{sources}）\n"
+    for batch, summary in summaries.items():
+        topics_text += f"\n【{'、'.join(platform_label(p) for p in batch)}】\n{summary.strip()}\n"
+    return Prompt(REPORT_SYSTEM_PROMPT,
+                  f"以下是各平台热搜的摘要（已由原始热搜整理而来）：\n{topics_text}")
+
+
+def build_map_prompt(batch: Dict[str, List[str]]) -> Prompt:
+    """map-reduce 模式的单批次提示词：只概括给定平台的热点"""
+    return Prompt(MAP_SYSTEM_PROMPT, f"以下是热搜数据：\n{format_topics(batch)}")
+
+
+def format_delta(deltas: Dict[str, Dict], min_move: int = 3) -> str:
+    """把各平台相对上一期的变化排成文本：新上榜、明显上升（至少 min_move 名）和落榜的条目"""
+    delta_text = ""
+    for platform, diff in deltas.items():
+        rising = [m for m in diff["moved"] if m["change"] >= min_move]
+        delta_text += f"\n【{platform_label(platform)}】\n"
+        if not (diff["new"] or rising or diff["dropped"]):
+            delta_text += "无明显变化\n"
+            continue
+        if diff["new"]:
+            delta_text += "新上榜：\n"
+            for item in diff["new"]:
+                delta_text += f"{item['rank']}. {item['title']}\n"
+        if rising:
+            delta_text += "排名上升：\n"
+            for item in rising:
+                delta_text += f"- {item['title']}（第 {item['previous_rank']} 名 → 第 {item['rank']} 名）\n"
+        if diff["dropped"]:
+            delta_text += "已落榜：\n"
+            for item in diff["dropped"]:
+                delta_text += f"- {item['title']}\n"
+    return delta_text
+
+
+def build_incremental_prompt(previous_report: str, deltas: Dict[str, Dict], minutes_ago: int) -> Prompt:
+    """增量模式的提示词：上一期报告加上此后各平台的变化，系统消息与完整报告相同以复用前缀缓存"""
+    return Prompt(REPORT_SYSTEM_PROMPT,
+                  f"以下是 {minutes_ago} 分钟前根据热搜数据写成的上一期报告：\n\n{previous_report.strip()}\n\n"
+                  f"此后各平台热搜的变化如下：\n{format_delta(deltas)}\n"
+                  "请在上一期报告的基础上写出更新后的完整报告：保留仍在榜的热点，删去已落榜的热点，"
+                  "补充新上榜和排名明显上升的热点。")
+
+
+def build_partial_report(streamed: str, all_topics: Dict[str, List[str]], clusters: Optional[List[Dict]],
+                         reason: str) -> str:
+    """模型分析未完成时的部分报告：醒目的标记（reason 说明原因），加上模型已生成的文本；
+    模型尚未输出任何内容时附上原始热搜"""
+    header = f"> ⚠️ 部分报告：{reason}，模型分析未完成。"
+    if streamed.strip():
+        return f"{header}以下为截至时限已生成的内容。\n\n{streamed.rstrip()}\n\n……（未完成）"
+    if clusters is not None:
+        topics_text = format_clusters(clusters, list(all_topics.keys()), label=platform_label, source=display_name)
+    else:
+        topics_text = format_topics(all_topics)
+    return f"{header}以下为收集到的原始热搜。\n{topics_text}"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文等全角字符约 1 字 1 token，其余字符约 4 个 1 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def context_size(prompt_tokens: int, num_predict: int, max_ctx: int) -> int:
+    """取能容纳提示词与输出预算（留 10% 余量）的最小一档上下文"""
+    needed = int((prompt_tokens + num_predict) * 1.1)
+    for bucket in CONTEXT_BUCKETS:
+        if bucket >= needed and bucket <= max_ctx:
+            return bucket
+    return max_ctx
+
+
+def build_options(prompt: Prompt, num_predict: int, temperature: float, max_ctx: int) -> Dict:
+    """根据估算的提示词长度确定 num_ctx，并保证输出预算不超出上下文"""
+    prompt_tokens = estimate_tokens(prompt.text())
+    num_ctx = context_size(prompt_tokens, num_predict, max_ctx)
+    return {
+        "temperature": temperature,
+        "num_predict": max(256, min(num_predict, num_ctx - prompt_tokens)),
+        "num_ctx": num_ctx
+    }
+
+
+def describe(prompt: Prompt, options: Dict) -> str:
+    """提示词规模的日志描述"""
+    system_tokens = estimate_tokens(prompt.system)
+    user_tokens = estimate_tokens(prompt.user)
+    return (f"📏 提示词 {len(prompt.text())} 字符，估算 {system_tokens + user_tokens} tokens"
+            f"（系统 {system_tokens} / 数据 {user_tokens}），"
+            f"num_ctx={options['num_ctx']}，num_predict={options['num_predict']}")
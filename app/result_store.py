@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+
+class ResultStore:
+    """分析结果存储
+
+    每次运行分配唯一 ID，结果写入 results/<id>.json，日志写入 logs/<id>.log，
+    并在 SQLite 索引（按创建时间排序）中登记，查询历史时无需扫描目录。
+    超出保留条数或保留天数的运行会在写入新结果后被清理。
+    方法均为同步调用，在事件循环中请通过 asyncio.to_thread 使用。
+    """
+
+    def __init__(self, root: str, max_runs: int = 500, max_age_days: float = 30):
+        self.root = root
+        self.max_runs = max_runs
+        self.max_age_days = max_age_days
+        self.results_dir = os.path.join(root, "results")
+        self.logs_dir = os.path.join(root, "logs")
+        self.index_path = os.path.join(root, "index.db")
+        os.makedirs(self.results_dir, exist_ok=True)
+        os.makedirs(self.logs_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    id TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    finished_at REAL,
+                    status TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    platforms TEXT NOT NULL,
+                    from_cache INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_created ON runs(created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def result_path(self, run_id: str) -> str:
+        return os.path.join(self.results_dir, f"{run_id}.json")
+
+    def log_path(self, run_id: str) -> str:
+        return os.path.join(self.logs_dir, f"{run_id}.log")
+
+    def start_run(self, model: str, platforms: List[str]) -> str:
+        """登记一次新的运行，返回运行 ID（时间前缀 + 随机后缀，按字典序即时间序）"""
+        run_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO runs (id, created_at, status, model, platforms) VALUES (?, ?, 'running', ?, ?)",
+                (run_id, time.time(), model, json.dumps(platforms, ensure_ascii=False))
+            )
+        finally:
+            conn.close()
+        return run_id
+
+    def save(self, run_id: str, output: Dict[str, Any]) -> str:
+        """写入结果文件并把运行标记为完成（超过时限的部分报告标记为 partial），返回结果文件路径"""
+        path = self.result_path(run_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE runs SET status = ?, finished_at = ?, platforms = ?, from_cache = ? WHERE id = ?",
+                ("partial" if output.get("partial") else "complete", time.time(), json.dumps(output.get("platforms_analyzed", []), ensure_ascii=False),
+                 int(bool(output.get("from_cache"))), run_id)
+            )
+        finally:
+            conn.close()
+        self.compact()
+        return path
+
+    def fail(self, run_id: str, error: str):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE runs SET status = 'failed', finished_at = ?, error = ? WHERE id = ? AND status = 'running'",
+                (time.time(), error, run_id)
+            )
+        finally:
+            conn.close()
+
+    def list(self, limit: int = 20, offset: int = 0, status: Optional[str] = None) -> Dict[str, Any]:
+        """按时间倒序分页列出运行记录"""
+        where, params = "", []
+        if status:
+            where, params = "WHERE status = ?", [status]
+        conn = self._connect()
+        try:
+            total = conn.execute(f"SELECT COUNT(*) FROM runs {where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT id, created_at, finished_at, status, model, platforms, from_cache, error "
+                f"FROM runs {where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        finally:
+            conn.close()
+        return {
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "items": [self._row_to_dict(row) for row in rows]
+        }
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT id, created_at, finished_at, status, model, platforms, from_cache, error "
+                "FROM runs WHERE id = ?", (run_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_dict(row) if row else None
+
+    def load(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """读取已完成（含部分报告）运行的结果 JSON"""
+        try:
+            with open(self.result_path(run_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """最近一次完成的运行记录"""
+        items = self.list(limit=1, status="complete")["items"]
+        return items[0] if items else None
+
+    def compact(self):
+        """删除超出保留条数或保留天数的运行及其结果、日志文件"""
+        cutoff = time.time() - self.max_age_days * 86400
+        conn = self._connect()
+        try:
+            expired = conn.execute(
+                "SELECT id FROM runs WHERE status != 'running' AND (created_at < ? OR id NOT IN "
+                "(SELECT id FROM runs ORDER BY created_at DESC LIMIT ?))",
+                (cutoff, self.max_runs)
+            ).fetchall()
+            for (run_id,) in expired:
+                conn.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+        finally:
+            conn.close()
+
+        for (run_id,) in expired:
+            for path in (self.result_path(run_id), self.log_path(run_id)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _row_to_dict(row) -> Dict[str, Any]:
+        run_id, created_at, finished_at, status, model, platforms, from_cache, error = row
+        return {
+            "id": run_id,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created_at)),
+            "duration": round(finished_at - created_at, 2) if finished_at else None,
+            "status": status,
+            "model": model,
+            "platforms": json.loads(platforms),
+            "from_cache": bool(from_cache),
+            "error": error
+        }
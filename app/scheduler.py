@@ -0,0 +1,123 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+from jobs import Job
+
+LATEST_KEY = "scheduler:latest"
+
+
+class ReportScheduler:
+    """定时预计算热点报告
+
+    每隔 interval 秒提交一次默认参数的分析任务，并保留最近一次成功的报告，
+    使请求可以在报告足够新时直接返回。上一次定时任务尚未结束时跳过本轮，不会堆积。
+    配置了共享状态时，由持有租约的一个 worker 负责定时提交，最近的报告也保存在共享状态中供所有 worker 使用。
+    """
+
+    def __init__(self, submit: Callable[[], Awaitable[Job]], key: Hashable, interval: float,
+                 initial_delay: float = 0, state: Any = None, worker_id: str = ""):
+        self.submit = submit
+        self.key = key
+        self.interval = interval
+        self.initial_delay = initial_delay
+        self.state = state
+        self.worker_id = worker_id
+        self.latest: Optional[Dict] = None
+        self.latest_at: Optional[float] = None
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self._job: Optional[Job] = None
+        self._task: Optional[asyncio.Task] = None
+        # 等待预计算任务结束、统计失败的协程；事件循环只弱引用任务，需要在这里保留引用
+        self._collectors: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self):
+        if self.enabled:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for task in self._collectors:
+            task.cancel()
+        await asyncio.gather(*self._collectors, return_exceptions=True)
+
+    async def fresh(self, key: Hashable, max_age: float) -> Optional[Dict]:
+        """参数一致且生成时间在 max_age 秒内时返回预计算的报告"""
+        if key != self.key:
+            return None
+        if self.state is not None:
+            shared = await asyncio.to_thread(self.state.get_value, LATEST_KEY)
+            if shared is not None and (self.latest_at is None or shared["at"] > self.latest_at):
+                self.latest, self.latest_at = shared["result"], shared["at"]
+        if self.latest is None:
+            return None
+        if time.time() - self.latest_at > max_age:
+            return None
+        return self.latest
+
+    async def record(self, key: Hashable, result: Dict):
+        """登记一份新完成的报告；任何参数一致的运行（不只是定时任务）都会刷新预计算结果"""
+        if key == self.key:
+            self.latest = result
+            self.latest_at = time.time()
+            if self.state is not None:
+                await asyncio.to_thread(self.state.put_value, LATEST_KEY, {"result": result, "at": self.latest_at})
+
+    def age(self) -> Optional[float]:
+        return round(time.time() - self.latest_at, 1) if self.latest_at else None
+
+    async def _loop(self):
+        await asyncio.sleep(self.initial_delay)
+        while True:
+            try:
+                if await self._is_leader():
+                    await self.trigger()
+            except Exception as e:
+                print(f"❌ 提交预计算任务失败: {e}", flush=True)
+            await asyncio.sleep(self.interval)
+
+    async def _is_leader(self) -> bool:
+        # 租约时长略大于间隔：持有者每轮续期，持有者退出后最多 1.5 个间隔由其他 worker 接手
+        if self.state is None:
+            return True
+        return await asyncio.to_thread(self.state.acquire_lease, "scheduler", self.worker_id, self.interval * 1.5)
+
+    async def trigger(self) -> Optional[Job]:
+        """提交一次预计算任务；上一次仍在排队或执行时跳过"""
+        if self._job is not None and not self._job.finished:
+            self.skipped += 1
+            print(f"⏭️  上一次预计算任务 {self._job.id} 尚未结束，跳过本轮", flush=True)
+            return None
+        self._job = await self.submit()
+        self.runs += 1
+        collector = asyncio.create_task(self._collect(self._job))
+        self._collectors.add(collector)
+        collector.add_done_callback(self._collectors.discard)
+        return self._job
+
+    async def _collect(self, job: Job):
+        # 成功的报告由任务执行方通过 record 登记，这里只统计失败
+        await job.wait()
+        if job.result is None:
+            self.failures += 1
+            print(f"❌ 预计算任务失败: {job.error}", flush=True)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "latest_run_id": (self.latest or {}).get("id"),
+            "latest_age_seconds": self.age()
+        }
@@ -0,0 +1,514 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# 任务记录字段；各后端的 get_job / claim 都返回这些字段组成的字典
+JOB_FIELDS = ("job_id", "key", "worker", "status", "created_at", "finished_at", "heartbeat_at",
+              "subscriber_seen_at", "cancel_requested", "last_event_id", "error")
+FINISHED = ("complete", "failed")
+
+
+class SharedStateError(Exception):
+    pass
+
+
+class SQLiteState:
+    """基于 SQLite（WAL 模式）的跨 worker 共享状态，适用于同一台机器上的多个 worker 进程
+
+    - claims 表按任务 key 登记执行者，实现跨 worker 的任务合并；执行者心跳超过 stale_after 秒视为失联
+    - job_events 表保存各任务最近 replay_limit 条事件，其他 worker 的订阅者从这里轮询
+    - leases 表提供带过期时间的租约（如定时任务只由一个 worker 触发），kv 表保存带过期时间的 JSON 值
+    - slots 表是计数的租约：同名槽位最多同时被 limit 个持有者占用（如所有 worker 合计的分析并发）
+    方法均为同步调用，在事件循环中请通过 asyncio.to_thread 使用。
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: str, stale_after: float = 30):
+        self.path = path
+        self.stale_after = stale_after
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    worker TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    finished_at REAL,
+                    heartbeat_at REAL NOT NULL,
+                    subscriber_seen_at REAL,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    last_event_id INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, job_id TEXT NOT NULL)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS slots (
+                    name TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (name, owner)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @staticmethod
+    def _job(row) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def _select_job(self, conn: sqlite3.Connection, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._job(conn.execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone())
+
+    def claim(self, key: str, job_id: str, worker: str) -> Dict[str, Any]:
+        """登记 key 的执行者并返回执行该 key 的任务记录
+
+        key 无人执行（或原执行者心跳超时）时登记为 job_id，返回的记录即为新任务；否则返回已有任务的记录。
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT job_id FROM claims WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                owner = self._select_job(conn, row[0])
+                if owner is not None and owner["status"] not in FINISHED:
+                    if owner["heartbeat_at"] >= now - self.stale_after:
+                        conn.execute("COMMIT")
+                        return owner
+                    # 接管失联 worker 的任务：原任务按失败结束，并补一条错误事件通知仍在订阅的客户端
+                    error = f"执行任务的 worker {owner['worker']} 已失联"
+                    seq = owner["last_event_id"] + 1
+                    conn.execute(
+                        "INSERT OR REPLACE INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                        (owner["job_id"], seq, json.dumps({"type": "error", "message": error}, ensure_ascii=False))
+                    )
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', finished_at = ?, error = ?, last_event_id = ? "
+                        "WHERE job_id = ?",
+                        (now, error, seq, owner["job_id"])
+                    )
+            conn.execute("INSERT OR REPLACE INTO claims (key, job_id) VALUES (?, ?)", (key, job_id))
+            conn.execute(
+                "INSERT INTO jobs (job_id, key, worker, status, created_at, heartbeat_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, key, worker, now, now)
+            )
+            job = self._select_job(conn, job_id)
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def sync(self, events: Dict[str, List[Tuple[int, Dict]]], alive: Dict[str, str],
+             finished: List[Tuple[str, str, Optional[str]]], replay_limit: int) -> List[str]:
+        """执行方定期调用：写入新事件，刷新进行中任务的状态和心跳，登记已结束的任务
+
+        events 为 {任务 ID: [(事件 ID, 事件)]}，alive 为 {任务 ID: 状态}，finished 为 [(任务 ID, 状态, 错误)]。
+        返回 alive 中被其他 worker 请求取消的任务 ID。
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job_id, batch in events.items():
+                conn.executemany(
+                    "INSERT OR REPLACE INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                    [(job_id, seq, json.dumps(event, ensure_ascii=False)) for seq, event in batch]
+                )
+                last_id = batch[-1][0]
+                conn.execute("UPDATE jobs SET last_event_id = ? WHERE job_id = ?", (last_id, job_id))
+                conn.execute("DELETE FROM job_events WHERE job_id = ? AND seq <= ?",
+                             (job_id, last_id - replay_limit))
+            conn.executemany(
+                "UPDATE jobs SET status = ?, heartbeat_at = ? WHERE job_id = ?",
+                [(status, now, job_id) for job_id, status in alive.items()]
+            )
+            for job_id, status, error in finished:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ?, heartbeat_at = ? WHERE job_id = ?",
+                    (status, error, now, now, job_id)
+                )
+                conn.execute("DELETE FROM claims WHERE job_id = ?", (job_id,))
+            cancelled = []
+            if alive:
+                placeholders = ",".join("?" * len(alive))
+                cancelled = [row[0] for row in conn.execute(
+                    f"SELECT job_id FROM jobs WHERE cancel_requested = 1 AND job_id IN ({placeholders})",
+                    list(alive)
+                )]
+            conn.execute("COMMIT")
+            return cancelled
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def read(self, job_id: str, after: int, limit: int = 500) -> Tuple[Optional[Dict[str, Any]], List[Tuple[int, Dict]]]:
+        """订阅方调用：返回 (任务记录, after 之后的最多 limit 条事件)，同时记录订阅方最近活跃的时间"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            # 限制写入频率：多个订阅者高频轮询时不必每次都更新
+            conn.execute("UPDATE jobs SET subscriber_seen_at = ? WHERE job_id = ? "
+                         "AND (subscriber_seen_at IS NULL OR subscriber_seen_at < ?)", (now, job_id, now - 1))
+            job = self._select_job(conn, job_id)
+            rows = conn.execute(
+                "SELECT seq, event FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, after, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return job, [(seq, json.loads(event)) for seq, event in rows]
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            return self._select_job(conn, job_id)
+        finally:
+            conn.close()
+
+    def request_cancel(self, job_id: str) -> bool:
+        """请求取消任务，由执行方在下一次 sync 时处理；任务不存在或已结束时返回 False"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status NOT IN ('complete', 'failed')",
+                (job_id,)
+            )
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """获取或续期租约：租约空闲、已过期或本来就属于 owner 时成功"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (name, owner, now + ttl, now)
+            )
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def acquire_slot(self, name: str, owner: str, limit: int, ttl: float) -> bool:
+        """占用或续期 name 的一个槽位：owner 已持有、或未过期的持有者少于 limit 时成功"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM slots WHERE name = ? AND expires_at < ?", (name, now))
+            held = conn.execute("SELECT 1 FROM slots WHERE name = ? AND owner = ?", (name, owner)).fetchone()
+            count = conn.execute("SELECT COUNT(*) FROM slots WHERE name = ?", (name,)).fetchone()[0]
+            acquired = held is not None or count < limit
+            if acquired:
+                conn.execute("INSERT OR REPLACE INTO slots (name, owner, expires_at) VALUES (?, ?, ?)",
+                             (name, owner, now + ttl))
+            conn.execute("COMMIT")
+            return acquired
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def release_slot(self, name: str, owner: str):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM slots WHERE name = ? AND owner = ?", (name, owner))
+        finally:
+            conn.close()
+
+    def put_value(self, key: str, value: Any, ttl: Optional[float] = None):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl if ttl else None)
+            )
+        finally:
+            conn.close()
+
+    def get_value(self, key: str) -> Optional[Any]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (key, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def prune(self, retention: float):
+        """清理结束超过 retention 秒的任务及其事件，以及过期的租约和键值"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM job_events WHERE job_id IN "
+                         "(SELECT job_id FROM jobs WHERE finished_at < ?)", (now - retention,))
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (now - retention,))
+            conn.execute("DELETE FROM claims WHERE job_id NOT IN (SELECT job_id FROM jobs)")
+            conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            conn.execute("DELETE FROM slots WHERE expires_at < ?", (now,))
+            conn.execute("DELETE FROM kv WHERE expires_at < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+class RedisState:
+    """基于 Redis（或兼容 Redis 协议的服务，如 Valkey、KeyDB）的共享状态，适用于多台机器上的副本
+
+    与 SQLiteState 接口一致：claim 用 SET NX 登记执行者（过期时间即心跳超时），
+    任务记录为哈希，事件保存在以事件 ID 为分值的有序集合中，租约和键值带过期时间，无需单独清理；
+    槽位是以过期时间为分值的有序集合，占用时先移除过期的持有者。
+    需要安装 redis 包；方法均为同步调用，在事件循环中请通过 asyncio.to_thread 使用。
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, stale_after: float = 30, retention: float = 600, prefix: str = "hot_trends:"):
+        try:
+            import redis
+        except ImportError:
+            raise SharedStateError("使用 Redis 共享状态需要安装 redis 包：pip install redis")
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.stale_after = stale_after
+        self.retention = retention
+        self.prefix = prefix
+        self._watch_error = redis.WatchError
+
+    def _key(self, *parts: str) -> str:
+        return self.prefix + ":".join(parts)
+
+    @staticmethod
+    def _job(data: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        if not data:
+            return None
+        job = {field: data.get(field) for field in JOB_FIELDS}
+        for field in ("created_at", "finished_at", "heartbeat_at", "subscriber_seen_at"):
+            job[field] = float(job[field]) if job[field] else None
+        job["last_event_id"] = int(job["last_event_id"] or 0)
+        job["cancel_requested"] = job["cancel_requested"] == "1"
+        job["error"] = job["error"] or None
+        return job
+
+    def claim(self, key: str, job_id: str, worker: str) -> Dict[str, Any]:
+        claim_key = self._key("claim", key)
+        job_key = self._key("job", job_id)
+        ttl_ms = int(self.stale_after * 1000)
+        while True:
+            # 先写任务记录再登记：其他 worker 看到登记时，登记指向的任务记录一定已经存在
+            now = time.time()
+            with self.redis.pipeline() as pipe:
+                pipe.hset(job_key, mapping={
+                    "job_id": job_id, "key": key, "worker": worker, "status": "queued",
+                    "created_at": now, "heartbeat_at": now, "cancel_requested": 0, "last_event_id": 0
+                })
+                pipe.expire(job_key, int(self.stale_after + self.retention))
+                pipe.execute()
+            if self.redis.set(claim_key, job_id, nx=True, px=ttl_ms):
+                return self.get_job(job_id)
+            self.redis.delete(job_key)
+            owner = self.redis.get(claim_key)
+            if owner is None:
+                continue
+            job = self.get_job(owner)
+            if job is None:
+                # 任务记录缺失时不删除登记（可能是其他实现或已过期的残留），等登记自行过期
+                time.sleep(0.05)
+                continue
+            if job["status"] not in FINISHED:
+                return job
+            # 登记指向的任务已结束，删除后重新登记
+            self._release(claim_key, owner)
+
+    def _release(self, claim_key: str, job_id: str):
+        # 只删除仍指向该任务的登记，避免误删其他 worker 刚写入的新登记
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(claim_key)
+                if pipe.get(claim_key) == job_id:
+                    pipe.multi()
+                    pipe.delete(claim_key)
+                    pipe.execute()
+            except self._watch_error:
+                pass
+
+    def sync(self, events: Dict[str, List[Tuple[int, Dict]]], alive: Dict[str, str],
+             finished: List[Tuple[str, str, Optional[str]]], replay_limit: int) -> List[str]:
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for job_id, batch in events.items():
+            events_key = self._key("events", job_id)
+            pipe.zadd(events_key, {f"{seq}:{json.dumps(event, ensure_ascii=False)}": seq for seq, event in batch})
+            pipe.zremrangebyscore(events_key, "-inf", batch[-1][0] - replay_limit)
+            pipe.expire(events_key, int(self.retention * 2))
+            pipe.hset(self._key("job", job_id), "last_event_id", batch[-1][0])
+        for job_id, status in alive.items():
+            job_key = self._key("job", job_id)
+            pipe.hset(job_key, mapping={"status": status, "heartbeat_at": now})
+            pipe.expire(job_key, int(self.retention * 2))
+        for job_id, status, error in finished:
+            job_key = self._key("job", job_id)
+            pipe.hset(job_key, mapping={"status": status, "error": error or "", "finished_at": now,
+                                        "heartbeat_at": now})
+            pipe.expire(job_key, int(self.retention))
+            pipe.expire(self._key("events", job_id), int(self.retention))
+        pipe.execute()
+
+        # 刷新进行中任务的登记有效期（即心跳），并取出取消请求
+        alive_jobs = [self._job(data) for data in self._hgetall_jobs(alive)]
+        pipe = self.redis.pipeline(transaction=False)
+        for job in alive_jobs:
+            if job is not None:
+                pipe.pexpire(self._key("claim", job["key"]), int(self.stale_after * 1000))
+        pipe.execute()
+        for job in self._hgetall_jobs(job_id for job_id, _, _ in finished):
+            job = self._job(job)
+            if job is not None:
+                self._release(self._key("claim", job["key"]), job["job_id"])
+        return [job["job_id"] for job in alive_jobs if job is not None and job["cancel_requested"]]
+
+    def _hgetall_jobs(self, job_ids) -> List[Dict[str, str]]:
+        pipe = self.redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hgetall(self._key("job", job_id))
+        return pipe.execute()
+
+    def read(self, job_id: str, after: int, limit: int = 500) -> Tuple[Optional[Dict[str, Any]], List[Tuple[int, Dict]]]:
+        job_key = self._key("job", job_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(job_key)
+        pipe.zrangebyscore(self._key("events", job_id), f"({after}", "+inf", start=0, num=limit)
+        data, members = pipe.execute()
+        if data:
+            # 任务记录已过期时不写入，避免留下没有过期时间的残缺哈希
+            self.redis.hset(job_key, "subscriber_seen_at", time.time())
+        events = []
+        for member in members:
+            seq, _, event = member.partition(":")
+            events.append((int(seq), json.loads(event)))
+        return self._job(data), events
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._job(self.redis.hgetall(self._key("job", job_id)))
+
+    def request_cancel(self, job_id: str) -> bool:
+        job = self.get_job(job_id)
+        if job is None or job["status"] in FINISHED:
+            return False
+        self.redis.hset(self._key("job", job_id), "cancel_requested", 1)
+        return True
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        lease_key = self._key("lease", name)
+        ttl_ms = int(ttl * 1000)
+        if self.redis.set(lease_key, owner, nx=True, px=ttl_ms):
+            return True
+        if self.redis.get(lease_key) == owner:
+            self.redis.pexpire(lease_key, ttl_ms)
+            return True
+        return False
+
+    def acquire_slot(self, name: str, owner: str, limit: int, ttl: float) -> bool:
+        slot_key = self._key("slot", name)
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(slot_key)
+                    # 只在事务内写入：WATCH 之后本连接的写入同样会让事务失败
+                    now = time.time()
+                    expires_at = pipe.zscore(slot_key, owner)
+                    held = expires_at is not None and expires_at >= now
+                    if not held and pipe.zcount(slot_key, now, "+inf") >= limit:
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.zremrangebyscore(slot_key, "-inf", now)
+                    pipe.zadd(slot_key, {owner: now + ttl})
+                    pipe.expire(slot_key, int(ttl) + 1)
+                    pipe.execute()
+                    return True
+                except self._watch_error:
+                    continue
+
+    def release_slot(self, name: str, owner: str):
+        self.redis.zrem(self._key("slot", name), owner)
+
+    def put_value(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.redis.set(self._key("kv", key), json.dumps(value, ensure_ascii=False),
+                       px=int(ttl * 1000) if ttl else None)
+
+    def get_value(self, key: str) -> Optional[Any]:
+        value = self.redis.get(self._key("kv", key))
+        return json.loads(value) if value is not None else None
+
+    def prune(self, retention: float):
+        # 所有键都带过期时间，由 Redis 自行清理
+        pass
+
+
+def create_state(backend: str, path: str = None, url: str = None, stale_after: float = 30,
+                 retention: float = 600):
+    """按配置创建共享状态：local 表示不共享（单 worker），sqlite 和 redis 用于多 worker 部署"""
+    if backend == "local":
+        return None
+    if backend == "sqlite":
+        return SQLiteState(path, stale_after=stale_after)
+    if backend == "redis":
+        if not url:
+            raise SharedStateError("STATE_BACKEND=redis 时需要配置 REDIS_URL")
+        return RedisState(url, stale_after=stale_after, retention=retention)
+    raise SharedStateError(f"未知的共享状态后端: {backend}")
@@ -0,0 +1,193 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from clustering import normalize_title
+
+
+def diff_topics(previous: List[str], current: List[str]) -> Dict[str, Any]:
+    """比较同一平台前后两份榜单：新上榜、落榜（仅限原先在当前榜单长度以内的条目）和排名变化
+
+    标题按 normalize_title 比较，标点、空白差异不算变化。change 为正表示排名上升。
+    """
+    previous_ranks = {}
+    for rank, title in enumerate(previous, 1):
+        previous_ranks.setdefault(normalize_title(title), rank)
+    current_keys = set()
+
+    new, moved = [], []
+    unchanged = 0
+    for rank, title in enumerate(current, 1):
+        key = normalize_title(title)
+        current_keys.add(key)
+        previous_rank = previous_ranks.get(key)
+        if previous_rank is None:
+            new.append({"title": title, "rank": rank})
+        elif previous_rank != rank:
+            moved.append({"title": title, "rank": rank, "previous_rank": previous_rank,
+                          "change": previous_rank - rank})
+        else:
+            unchanged += 1
+
+    dropped = [
+        {"title": title, "previous_rank": rank}
+        for rank, title in enumerate(previous[:len(current)], 1)
+        if normalize_title(title) not in current_keys
+    ]
+    return {"new": new, "dropped": dropped, "moved": moved, "unchanged": unchanged}
+
+
+def diff_counts(diff: Dict[str, Any]) -> Dict[str, int]:
+    return {"new": len(diff["new"]), "dropped": len(diff["dropped"]),
+            "moved": len(diff["moved"]), "unchanged": diff["unchanged"]}
+
+
+class SnapshotStore:
+    """各平台热搜快照与增量分析基线
+
+    snapshots 表按时间保存每个平台的榜单，与上一份完全相同时只更新 last_seen_at，不重复写入；
+    baselines 表为每组分析参数保存最近一份报告及其所依据的快照，供增量分析使用。
+    快照超过 max_age_days 天后删除。方法均为同步调用，在事件循环中请通过 asyncio.to_thread 使用。
+    """
+
+    def __init__(self, path: str, max_age_days: float = 7):
+        self.path = path
+        self.max_age_days = max_age_days
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    platform TEXT NOT NULL,
+                    taken_at REAL NOT NULL,
+                    last_seen_at REAL NOT NULL,
+                    titles TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_platform ON snapshots(platform, taken_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS baselines (
+                    key TEXT PRIMARY KEY,
+                    run_id TEXT,
+                    created_at REAL NOT NULL,
+                    analysis TEXT NOT NULL,
+                    snapshots TEXT NOT NULL,
+                    chain INTEGER NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @staticmethod
+    def _row(row) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        return {"id": row[0], "platform": row[1], "taken_at": row[2], "last_seen_at": row[3],
+                "titles": json.loads(row[4])}
+
+    def record(self, platform: str, titles: List[str]) -> Dict[str, Any]:
+        """保存一份快照并返回 {"id", "previous"}，previous 为保存前该平台最新的快照（没有则为 None）"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            latest = self._row(conn.execute(
+                "SELECT id, platform, taken_at, last_seen_at, titles FROM snapshots "
+                "WHERE platform = ? ORDER BY taken_at DESC, id DESC LIMIT 1", (platform,)
+            ).fetchone())
+            if latest is not None and latest["titles"] == titles:
+                conn.execute("UPDATE snapshots SET last_seen_at = ? WHERE id = ?", (now, latest["id"]))
+                snapshot_id = latest["id"]
+            else:
+                snapshot_id = conn.execute(
+                    "INSERT INTO snapshots (platform, taken_at, last_seen_at, titles) VALUES (?, ?, ?, ?)",
+                    (platform, now, now, json.dumps(titles, ensure_ascii=False))
+                ).lastrowid
+            conn.execute("DELETE FROM snapshots WHERE last_seen_at < ?", (now - self.max_age_days * 86400,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return {"id": snapshot_id, "previous": latest}
+
+    def get(self, snapshot_id: int) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            return self._row(conn.execute(
+                "SELECT id, platform, taken_at, last_seen_at, titles FROM snapshots WHERE id = ?",
+                (snapshot_id,)
+            ).fetchone())
+        finally:
+            conn.close()
+
+    def movements(self, platform: str, window: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """该平台最新快照相对于上一份（或 window 秒之前的那份）快照的变化，没有快照时返回 None"""
+        conn = self._connect()
+        try:
+            current = self._row(conn.execute(
+                "SELECT id, platform, taken_at, last_seen_at, titles FROM snapshots "
+                "WHERE platform = ? ORDER BY taken_at DESC, id DESC LIMIT 1", (platform,)
+            ).fetchone())
+            if current is None:
+                return None
+            if window is None:
+                query = ("SELECT id, platform, taken_at, last_seen_at, titles FROM snapshots "
+                         "WHERE platform = ? AND id != ? ORDER BY taken_at DESC, id DESC LIMIT 1")
+                params = (platform, current["id"])
+            else:
+                query = ("SELECT id, platform, taken_at, last_seen_at, titles FROM snapshots "
+                         "WHERE platform = ? AND id != ? AND last_seen_at <= ? ORDER BY taken_at DESC, id DESC LIMIT 1")
+                params = (platform, current["id"], current["last_seen_at"] - window)
+            previous = self._row(conn.execute(query, params).fetchone())
+        finally:
+            conn.close()
+
+        result = {
+            "platform": platform,
+            "current_at": current["taken_at"],
+            "last_seen_at": current["last_seen_at"],
+            "previous_at": previous["taken_at"] if previous else None
+        }
+        if previous is None:
+            return {**result, "new": [], "dropped": [], "moved": [], "unchanged": len(current["titles"])}
+        return {**result, **diff_topics(previous["titles"], current["titles"])}
+
+    def get_baseline(self, key: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT run_id, created_at, analysis, snapshots, chain FROM baselines WHERE key = ?", (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {"run_id": row[0], "created_at": row[1], "analysis": row[2],
+                "snapshots": json.loads(row[3]), "chain": row[4]}
+
+    def set_baseline(self, key: str, run_id: Optional[str], analysis: str,
+                     snapshots: Dict[str, int], chain: int):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO baselines (key, run_id, created_at, analysis, snapshots, chain) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, run_id, time.time(), analysis, json.dumps(snapshots), chain)
+            )
+        finally:
+            conn.close()
+
+    def platforms(self) -> List[str]:
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute("SELECT DISTINCT platform FROM snapshots ORDER BY platform")]
+        finally:
+            conn.close()
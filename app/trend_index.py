@@ -0,0 +1,284 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from clustering import normalize_title
+
+
+class TrendIndex:
+    """热搜历史的时间序列索引（SQLite）
+
+    - topics：按 normalize_title 去重的话题，标题另建 FTS5 trigram 全文索引
+    - observations：每次从上游获取到的 (话题, 平台, 时间, 排名)，主键按话题聚簇，单个话题的历史查询只读相邻的几页
+    - spans：话题在某平台连续在榜的区间，相邻两次出现间隔不超过 span_gap 秒即视为连续；
+      按时间范围统计的查询只扫描区间表，不必遍历全部观测
+    observations 超过 retention_days 天后删除，spans 与 topics 保留。
+    方法均为同步调用，在事件循环中请通过 asyncio.to_thread 使用。
+    """
+
+    def __init__(self, path: str, span_gap: float = 3600, retention_days: float = 180):
+        self.path = path
+        self.span_gap = span_gap
+        self.retention_days = retention_days
+        self._pruned_at = 0.0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS platforms (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS topics (
+                    id INTEGER PRIMARY KEY,
+                    norm TEXT NOT NULL UNIQUE,
+                    title TEXT NOT NULL,
+                    first_seen INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS observations (
+                    topic_id INTEGER NOT NULL,
+                    platform_id INTEGER NOT NULL,
+                    seen_at INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    PRIMARY KEY (topic_id, platform_id, seen_at)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_observations_seen ON observations(seen_at);
+                CREATE TABLE IF NOT EXISTS spans (
+                    id INTEGER PRIMARY KEY,
+                    topic_id INTEGER NOT NULL,
+                    platform_id INTEGER NOT NULL,
+                    start_at INTEGER NOT NULL,
+                    end_at INTEGER NOT NULL,
+                    best_rank INTEGER NOT NULL,
+                    samples INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_spans_topic ON spans(topic_id, platform_id, end_at);
+                CREATE INDEX IF NOT EXISTS idx_spans_end ON spans(end_at);
+            """)
+            try:
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS topics_fts USING fts5(title, tokenize='trigram')")
+                self.fts = True
+            except sqlite3.OperationalError:
+                # SQLite 版本过低（< 3.34）不支持 trigram 分词，搜索退化为 LIKE
+                self.fts = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def ingest(self, platform: str, titles: List[str], seen_at: Optional[float] = None):
+        """写入一次获取到的完整榜单"""
+        now = int(seen_at if seen_at is not None else time.time())
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO platforms (name) VALUES (?)", (platform,))
+            platform_id = conn.execute("SELECT id FROM platforms WHERE name = ?", (platform,)).fetchone()[0]
+            for rank, title in enumerate(titles, 1):
+                norm = normalize_title(title) or title
+                cursor = conn.execute("INSERT OR IGNORE INTO topics (norm, title, first_seen) VALUES (?, ?, ?)",
+                                      (norm, title, now))
+                if cursor.rowcount:
+                    topic_id = cursor.lastrowid
+                    if self.fts:
+                        conn.execute("INSERT INTO topics_fts (rowid, title) VALUES (?, ?)", (topic_id, title))
+                else:
+                    topic_id = conn.execute("SELECT id FROM topics WHERE norm = ?", (norm,)).fetchone()[0]
+
+                conn.execute("INSERT OR REPLACE INTO observations (topic_id, platform_id, seen_at, rank) "
+                             "VALUES (?, ?, ?, ?)", (topic_id, platform_id, now, rank))
+                span = conn.execute(
+                    "SELECT id, end_at FROM spans WHERE topic_id = ? AND platform_id = ? "
+                    "ORDER BY end_at DESC LIMIT 1", (topic_id, platform_id)
+                ).fetchone()
+                if span is not None and 0 <= now - span[1] <= self.span_gap:
+                    conn.execute("UPDATE spans SET end_at = ?, best_rank = MIN(best_rank, ?), samples = samples + 1 "
+                                 "WHERE id = ?", (now, rank, span[0]))
+                elif span is None or now > span[1]:
+                    conn.execute("INSERT INTO spans (topic_id, platform_id, start_at, end_at, best_rank, samples) "
+                                 "VALUES (?, ?, ?, ?, ?, 1)", (topic_id, platform_id, now, now, rank))
+            if time.time() - self._pruned_at > 3600:
+                conn.execute("DELETE FROM observations WHERE seen_at < ?",
+                             (int(time.time() - self.retention_days * 86400),))
+                self._pruned_at = time.time()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def top(self, since: float, until: float, limit: int = 20, platform: Optional[str] = None,
+            max_rank: Optional[int] = None) -> List[Dict[str, Any]]:
+        """时间范围内的热门话题：按覆盖平台数、在榜总时长排序
+
+        max_rank 只统计曾进入该排名以内的在榜区间，platform 只统计指定平台。
+        """
+        where = ["s.end_at >= ?", "s.start_at <= ?"]
+        params: List[Any] = [int(since), int(until)]
+        if platform:
+            where.append("p.name = ?")
+            params.append(platform)
+        if max_rank:
+            where.append("s.best_rank <= ?")
+            params.append(max_rank)
+        conn = self._connect()
+        try:
+            rows = conn.execute(f"""
+                SELECT t.id, t.title, COUNT(DISTINCT s.platform_id) AS platform_count,
+                       GROUP_CONCAT(DISTINCT p.name), MIN(s.best_rank),
+                       SUM(MIN(s.end_at, ?) - MAX(s.start_at, ?)) AS on_list,
+                       MIN(s.start_at), MAX(s.end_at)
+                FROM spans s
+                JOIN topics t ON t.id = s.topic_id
+                JOIN platforms p ON p.id = s.platform_id
+                WHERE {" AND ".join(where)}
+                GROUP BY s.topic_id
+                ORDER BY platform_count DESC, on_list DESC, MIN(s.best_rank)
+                LIMIT ?
+            """, [int(until), int(since), *params, limit]).fetchall()
+        finally:
+            conn.close()
+        return [
+            {"topic_id": row[0], "title": row[1], "platform_count": row[2], "platforms": row[3].split(","),
+             "best_rank": row[4], "on_list_seconds": row[5], "first_seen": row[6], "last_seen": row[7]}
+            for row in rows
+        ]
+
+    def search(self, query: str, limit: int = 20, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """按标题全文搜索话题；不足 3 个字符时 trigram 无法匹配，改用 LIKE"""
+        conn = self._connect()
+        try:
+            if self.fts and len(query) >= 3:
+                rows = conn.execute(
+                    "SELECT t.id, t.title, t.first_seen FROM topics_fts f JOIN topics t ON t.id = f.rowid "
+                    "WHERE topics_fts MATCH ? ORDER BY rank LIMIT ?",
+                    ('"' + query.replace('"', '""') + '"', limit * 5 if since else limit)
+                ).fetchall()
+            else:
+                pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                rows = conn.execute(
+                    "SELECT id, title, first_seen FROM topics WHERE title LIKE ? ESCAPE '\\' "
+                    "ORDER BY first_seen DESC LIMIT ?", (pattern, limit * 5 if since else limit)
+                ).fetchall()
+
+            results = []
+            for topic_id, title, first_seen in rows:
+                summary = conn.execute(
+                    "SELECT MAX(s.end_at), GROUP_CONCAT(DISTINCT p.name), MIN(s.best_rank) FROM spans s "
+                    "JOIN platforms p ON p.id = s.platform_id WHERE s.topic_id = ?", (topic_id,)
+                ).fetchone()
+                if since and (summary[0] or 0) < since:
+                    continue
+                results.append({"topic_id": topic_id, "title": title, "first_seen": first_seen,
+                                "last_seen": summary[0], "platforms": (summary[1] or "").split(",") if summary[1] else [],
+                                "best_rank": summary[2]})
+                if len(results) >= limit:
+                    break
+        finally:
+            conn.close()
+        return results
+
+    def find_topic(self, title: str) -> Optional[int]:
+        """按标题定位话题：先按规范化标题精确匹配，否则取全文搜索的第一条"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT id FROM topics WHERE norm = ?", (normalize_title(title) or title,)).fetchone()
+        finally:
+            conn.close()
+        if row is not None:
+            return row[0]
+        matches = self.search(title, limit=1)
+        return matches[0]["topic_id"] if matches else None
+
+    def lifetime(self, topic_id: int, top_n: Optional[int] = None,
+                 include_series: bool = False) -> Optional[Dict[str, Any]]:
+        """话题在各平台的在榜历史：连续在榜区间、最高排名，以及处于前 top_n 名的累计时长
+
+        相邻两次观测间隔超过 span_gap 时，该间隔不计入时长。
+        """
+        conn = self._connect()
+        try:
+            topic = conn.execute("SELECT id, title, first_seen FROM topics WHERE id = ?", (topic_id,)).fetchone()
+            if topic is None:
+                return None
+            platforms = {}
+            for name, start_at, end_at, best_rank, samples in conn.execute(
+                    "SELECT p.name, s.start_at, s.end_at, s.best_rank, s.samples FROM spans s "
+                    "JOIN platforms p ON p.id = s.platform_id WHERE s.topic_id = ? ORDER BY s.start_at",
+                    (topic_id,)):
+                entry = platforms.setdefault(name, {"spans": [], "best_rank": best_rank, "on_list_seconds": 0})
+                entry["spans"].append({"start_at": start_at, "end_at": end_at, "best_rank": best_rank,
+                                       "samples": samples})
+                entry["best_rank"] = min(entry["best_rank"], best_rank)
+                entry["on_list_seconds"] += end_at - start_at
+
+            if top_n or include_series:
+                series: Dict[str, List] = {}
+                for name, seen_at, rank in conn.execute(
+                        "SELECT p.name, o.seen_at, o.rank FROM observations o "
+                        "JOIN platforms p ON p.id = o.platform_id WHERE o.topic_id = ? ORDER BY o.platform_id, o.seen_at",
+                        (topic_id,)):
+                    series.setdefault(name, []).append((seen_at, rank))
+                for name, points in series.items():
+                    entry = platforms.get(name)
+                    if entry is None:
+                        continue
+                    if top_n:
+                        entry[f"top_{top_n}_seconds"] = sum(
+                            later[0] - earlier[0] for earlier, later in zip(points, points[1:])
+                            if earlier[1] <= top_n and later[0] - earlier[0] <= self.span_gap
+                        )
+                    if include_series:
+                        entry["series"] = [{"seen_at": seen_at, "rank": rank} for seen_at, rank in points]
+        finally:
+            conn.close()
+        return {"topic_id": topic[0], "title": topic[1], "first_seen": topic[2], "platforms": platforms}
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        try:
+            counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ("topics", "observations", "spans")}
+        finally:
+            conn.close()
+        return {**counts, "fts": self.fts, "span_gap": self.span_gap,
+                "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0}
+
+
+def backfill(index: TrendIndex, output_dir: str) -> int:
+    """从已保存的分析结果 JSON 导入历史数据（只包含当时参与分析的前若干条），返回导入的结果数"""
+    paths = glob.glob(os.path.join(output_dir, "results", "*.json")) + \
+        glob.glob(os.path.join(output_dir, "hot_trends_analysis_*.json"))
+    loaded = []
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+            seen_at = time.mktime(time.strptime(result["timestamp"], "%Y-%m-%d %H:%M:%S"))
+        except (OSError, ValueError, KeyError):
+            continue
+        loaded.append((seen_at, result.get("raw_data") or {}))
+
+    # 按时间顺序导入，在榜区间才能正确衔接
+    for seen_at, raw_data in sorted(loaded, key=lambda item: item[0]):
+        for platform, titles in raw_data.items():
+            if not platform.startswith("_") and isinstance(titles, list):
+                index.ingest(platform, titles, seen_at=seen_at)
+    return len(loaded)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从已保存的分析结果回填热搜历史索引")
+    parser.add_argument("--output-dir", default=os.getenv("OUTPUT_DIR", "/app/outputs"), help="结果目录")
+    parser.add_argument("--index-path", help="索引数据库路径，默认 <output-dir>/trend_index.db")
+    args = parser.parse_args()
+
+    index = TrendIndex(args.index_path or os.path.join(args.output_dir, "trend_index.db"))
+    count = backfill(index, args.output_dir)
+    print(f"✅ 已导入 {count} 份结果：{index.stats()}")
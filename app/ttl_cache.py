@@ -0,0 +1,122 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+@dataclass
+class CacheResult:
+    """一次缓存查询的结果：value 为 None 表示加载失败"""
+    value: Any
+    status: str  # hit / stale / miss
+    age: float   # 数据获取至今的秒数
+
+
+@dataclass
+class _Entry:
+    value: Any
+    fetched_at: float
+    size: int
+
+
+class TTLCache:
+    """进程内 TTL 缓存
+
+    - 条目在 ttl 秒内直接命中；过期但仍在 stale_ttl 宽限期内时先返回旧值，同时在后台刷新
+    - 按最近使用顺序淘汰，同时限制条目数和估算的内存占用
+    - 同一个 key 的并发加载会合并为一次上游请求
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0, max_entries: int = 256,
+                 max_bytes: int = 16 * 1024 * 1024, size_of: Callable[[Any], int] = None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of or (lambda value: 1)
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                  refresh: Callable[[], Awaitable[Any]] = None) -> CacheResult:
+        """查询缓存，未命中时调用 loader 加载；loader 返回 None 表示失败，不写入缓存
+
+        refresh 为后台刷新时使用的加载函数，不应绑定到发起查询的调用方（如某次运行的日志），未指定时使用 loader；
+        后台刷新在独立的上下文中执行，不继承调用方的 contextvars（如运行 trace）。
+        """
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None:
+            age = now - entry.fetched_at
+            if age < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return CacheResult(entry.value, "hit", age)
+            if age < self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                self._load(key, refresh or loader, background=True)  # 后台刷新，不等待结果
+                return CacheResult(entry.value, "stale", age)
+
+        self.misses += 1
+        if key in self._inflight:
+            self.coalesced += 1
+        # shield：单个等待方被取消（如超时）时不影响其他等待方共享的加载任务
+        value = await asyncio.shield(self._load(key, loader))
+        return CacheResult(value, "miss", 0.0)
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], background: bool = False) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            context = contextvars.Context() if background else None
+            task = asyncio.create_task(self._run_loader(key, loader), context=context)
+            self._inflight[key] = task
+        return task
+
+    async def _run_loader(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await loader()
+            if value is not None:
+                self.put(key, value)
+            return value
+        except Exception:
+            return None
+        finally:
+            self._inflight.pop(key, None)
+
+    def put(self, key: Hashable, value: Any):
+        """写入缓存并按 LRU 淘汰超出上限的条目"""
+        self.invalidate(key)
+        entry = _Entry(value, time.monotonic(), self.size_of(value))
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def invalidate(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+        }
@@ -0,0 +1,193 @@
+"""DailyHotApi 与 Ollama 的本地替身，供基准测试使用
+
+- 热搜接口：GET /hot/{platform}，可按平台配置延迟、失败率和榜单长度
+- Ollama：/api/tags、/api/pull（流式进度）、/api/generate（仅预热）、/api/chat（流式或非流式，按设定速率输出 token）
+
+单独运行：python bench/fake_upstreams.py --port 18080
+"""
+import argparse
+import asyncio
+import json
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 各平台共有的话题，用于让聚类、跨平台分析有内容可做
+SHARED_TOPICS = [
+    "台风登陆东南沿海多地停课",
+    "新款旗舰手机正式发布",
+    "国足世预赛最新战报",
+    "多地发布高温橙色预警",
+    "知名演员官宣新剧定档",
+]
+
+FILLER_TEXT = "当前网络热点主要集中在社会民生、科技产品和体育赛事三个方面，多个平台同时关注相关话题。"
+
+# 生成平台独有标题用的字符池
+TITLE_CHARS = "城市交通教育医疗科技体育娱乐财经汽车旅游美食游戏电影音乐读书健康天气航天芯片手机电脑网络"
+
+
+def unique_title(platform: str, index: int) -> str:
+    """按平台和序号确定性地生成互不相似的标题"""
+    rng = random.Random(f"{platform}-{index}")
+    return "".join(rng.choice(TITLE_CHARS) for _ in range(rng.randint(8, 16)))
+
+
+@dataclass
+class PlatformProfile:
+    latency: float = 0.2       # 平均响应延迟（秒）
+    jitter: float = 0.1        # 延迟的随机波动（秒）
+    failure_rate: float = 0.0  # 返回 500 的概率
+    list_size: int = 50        # 榜单条数
+
+
+@dataclass
+class FakeProfile:
+    default_platform: PlatformProfile = field(default_factory=PlatformProfile)
+    platforms: Dict[str, PlatformProfile] = field(default_factory=dict)
+    models: List[str] = field(default_factory=lambda: ["qwen2.5:14b"])
+    token_rate: float = 40          # 生成速度（tokens/s）
+    prefill_rate: float = 2000      # 提示词处理速度（tokens/s），决定首 token 时延
+    completion_tokens: int = 400    # 每次生成的 token 数（不超过请求中的 num_predict）
+    pull_seconds: float = 2.0       # 模拟拉取模型的耗时
+    load_seconds: float = 0.5       # 模拟加载模型进显存的耗时
+    chat_failure_rate: float = 0.0
+
+    def platform(self, name: str) -> PlatformProfile:
+        return self.platforms.get(name, self.default_platform)
+
+
+def create_app(profile: FakeProfile) -> FastAPI:
+    app = FastAPI(title="Fake upstreams")
+    app.state.profile = profile
+    app.state.calls = {"hot": 0, "chat": 0, "pull": 0, "tags": 0, "generate": 0}
+
+    @app.get("/hot/{platform}")
+    async def hot(platform: str):
+        app.state.calls["hot"] += 1
+        p = profile.platform(platform)
+        await asyncio.sleep(max(0.0, random.gauss(p.latency, p.jitter)))
+        if random.random() < p.failure_rate:
+            return JSONResponse({"code": 500, "message": "fake failure"}, status_code=500)
+        titles = SHARED_TOPICS[:max(0, min(len(SHARED_TOPICS), p.list_size // 5))]
+        titles += [unique_title(platform, i) for i in range(p.list_size - len(titles))]
+        random.shuffle(titles)
+        return {"code": 200, "name": platform, "data": [{"title": t, "hot": 1000 - i} for i, t in enumerate(titles)]}
+
+    @app.get("/api/tags")
+    async def tags():
+        app.state.calls["tags"] += 1
+        return {"models": [{"name": name, "size": 9_000_000_000, "modified_at": "2024-01-01T00:00:00Z"}
+                           for name in profile.models]}
+
+    @app.post("/api/pull")
+    async def pull(body: dict):
+        app.state.calls["pull"] += 1
+        name = body.get("name") or body.get("model")
+
+        async def progress():
+            steps = 10
+            for i in range(steps):
+                await asyncio.sleep(profile.pull_seconds / steps)
+                yield json.dumps({"status": "pulling", "completed": i + 1, "total": steps}) + "\n"
+            if name and name not in profile.models:
+                profile.models.append(name)
+            yield json.dumps({"status": "success"}) + "\n"
+
+        return StreamingResponse(progress(), media_type="application/x-ndjson")
+
+    @app.post("/api/generate")
+    async def generate(body: dict):
+        # 只支持不带 prompt 的加载请求（预热）
+        app.state.calls["generate"] += 1
+        await asyncio.sleep(profile.load_seconds)
+        return {"model": body.get("model"), "response": "", "done": True, "done_reason": "load"}
+
+    @app.post("/api/chat")
+    async def chat(body: dict):
+        app.state.calls["chat"] += 1
+        if random.random() < profile.chat_failure_rate:
+            return JSONResponse({"error": "fake failure"}, status_code=500)
+
+        prompt_chars = sum(len(m.get("content", "")) for m in body.get("messages", []))
+        num_predict = (body.get("options") or {}).get("num_predict") or profile.completion_tokens
+        count = min(profile.completion_tokens, num_predict)
+        tokens = [FILLER_TEXT[i % len(FILLER_TEXT)] for i in range(count)]
+        prefill = prompt_chars / profile.prefill_rate
+
+        if not body.get("stream", True):
+            await asyncio.sleep(prefill + count / profile.token_rate)
+            return {"message": {"role": "assistant", "content": "".join(tokens)}, "done": True,
+                    "prompt_eval_count": prompt_chars, "eval_count": count,
+                    "eval_duration": int(count / profile.token_rate * 1e9)}
+
+        async def stream():
+            await asyncio.sleep(prefill)
+            for token in tokens:
+                await asyncio.sleep(1 / profile.token_rate)
+                yield json.dumps({"message": {"role": "assistant", "content": token}, "done": False}) + "\n"
+            yield json.dumps({"message": {"role": "assistant", "content": ""}, "done": True,
+                              "prompt_eval_count": prompt_chars, "eval_count": count,
+                              "eval_duration": int(count / profile.token_rate * 1e9)}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.get("/calls")
+    async def calls():
+        return app.state.calls
+
+    return app
+
+
+def parse_platform_profiles(specs: List[str]) -> Dict[str, PlatformProfile]:
+    """解析 平台=延迟:失败率:条数 形式的单平台配置，例如 weibo=1.5:0.2:50"""
+    profiles = {}
+    for spec in specs or []:
+        name, values = spec.split("=", 1)
+        latency, failure_rate, list_size = (values.split(":") + ["", "", ""])[:3]
+        profiles[name] = PlatformProfile(
+            latency=float(latency or 0.2),
+            failure_rate=float(failure_rate or 0),
+            list_size=int(list_size or 50)
+        )
+    return profiles
+
+
+def add_profile_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--platform-latency", type=float, default=0.2, help="热搜接口平均延迟（秒）")
+    parser.add_argument("--platform-jitter", type=float, default=0.1, help="热搜接口延迟波动（秒）")
+    parser.add_argument("--platform-failure-rate", type=float, default=0.0, help="热搜接口失败率")
+    parser.add_argument("--list-size", type=int, default=50, help="每个平台返回的榜单条数")
+    parser.add_argument("--platform-profile", nargs="*", default=[],
+                        help="单平台配置：平台=延迟:失败率:条数，例如 weibo=1.5:0.2:50")
+    parser.add_argument("--token-rate", type=float, default=40, help="模拟生成速度（tokens/s）")
+    parser.add_argument("--prefill-rate", type=float, default=2000, help="模拟提示词处理速度（tokens/s）")
+    parser.add_argument("--completion-tokens", type=int, default=400, help="每次生成的 token 数")
+    parser.add_argument("--pull-seconds", type=float, default=2.0, help="模拟拉取模型耗时（秒）")
+    parser.add_argument("--chat-failure-rate", type=float, default=0.0, help="chat 接口失败率")
+
+
+def profile_from_args(args) -> FakeProfile:
+    return FakeProfile(
+        default_platform=PlatformProfile(args.platform_latency, args.platform_jitter,
+                                         args.platform_failure_rate, args.list_size),
+        platforms=parse_platform_profiles(args.platform_profile),
+        token_rate=args.token_rate,
+        prefill_rate=args.prefill_rate,
+        completion_tokens=args.completion_tokens,
+        pull_seconds=args.pull_seconds,
+        chat_failure_rate=args.chat_failure_rate
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="DailyHotApi / Ollama 本地替身")
+    parser.add_argument("--port", type=int, default=18080)
+    add_profile_args(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(profile_from_args(args)), host="127.0.0.1", port=args.port, log_level="warning")
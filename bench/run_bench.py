@@ -0,0 +1,255 @@
+"""端到端基准测试：在本地替身上驱动 /api/analyze-stream
+
+在同一进程内用独立线程分别启动替身服务和被测应用（各自拥有事件循环），
+由多个并发客户端反复发起分析，统计：
+
+- 端到端延迟、首条日志时延、首 token 时延的 p50/p95/p99
+- 每分钟完成的运行数
+- 被测应用事件循环的阻塞情况（定时探针的调度延迟）
+
+结果保存为 bench/results/ 下的 JSON，可用 --compare 与之前的结果对比。
+
+用法：python bench/run_bench.py --clients 8 --runs-per-client 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+sys.path.insert(0, BENCH_DIR)
+from fake_upstreams import add_profile_args, create_app, profile_from_args  # noqa: E402
+
+
+class ServerThread:
+    """在独立线程和事件循环中运行 uvicorn，便于向被测应用的事件循环注入探针"""
+
+    def __init__(self, app, port: int):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port,
+                                                    log_level="warning", lifespan="on"))
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.server.serve())
+
+    def start(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+async def probe_loop_lag(interval: float, stop: threading.Event, samples: List[float]):
+    """每隔 interval 秒醒来一次，实际醒来时间比预期晚多少就是事件循环被阻塞的时长"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 4)
+
+
+def distribution(values: List[float]) -> Dict:
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99),
+            "max": round(max(values), 4) if values else None}
+
+
+async def one_run(client: httpx.AsyncClient, url: str, body: Dict) -> Dict:
+    started = time.perf_counter()
+    first_log = first_token = None
+    outcome = "incomplete"
+    async with client.stream("POST", url, json=body) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            elapsed = time.perf_counter() - started
+            if event["type"] == "log" and first_log is None:
+                first_log = elapsed
+            elif event["type"] == "token" and first_token is None and event.get("content"):
+                first_token = elapsed
+            elif event["type"] == "complete":
+                outcome = "complete"
+                break
+            elif event["type"] == "error":
+                outcome = "error"
+                break
+    return {"outcome": outcome, "latency": time.perf_counter() - started,
+            "first_log": first_log, "first_token": first_token}
+
+
+async def drive(args, base_url: str) -> Tuple[List[Dict], float]:
+    url = f"{base_url}/api/analyze-stream"
+    timeout = httpx.Timeout(args.request_timeout, connect=10)
+    runs = []
+
+    async def client_loop(index: int):
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            for _ in range(args.runs_per_client):
+                body = {"platforms": args.platforms, "use_cache": args.use_cache,
+                        "mode": args.mode, "dedupe": not args.no_dedupe}
+                # 默认每个客户端使用不同的条数，避免请求被合并；--coalesce 时发送完全相同的请求
+                body["topics_per_platform"] = args.topics_per_platform + (0 if args.coalesce else index)
+                try:
+                    runs.append(await one_run(client, url, body))
+                except httpx.HTTPError as e:
+                    runs.append({"outcome": f"http_error: {e.__class__.__name__}"})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(i) for i in range(args.clients)))
+    return runs, time.perf_counter() - started
+
+
+def summarize(runs: List[Dict], wall: float, lag_samples: List[float], lag_interval: float) -> Dict:
+    ok = [r for r in runs if r["outcome"] == "complete"]
+    blocked = [lag for lag in lag_samples if lag > 0.005]
+    return {
+        "runs": len(runs),
+        "completed": len(ok),
+        "failed": len(runs) - len(ok),
+        "wall_seconds": round(wall, 3),
+        "runs_per_minute": round(len(ok) / wall * 60, 2) if wall else 0,
+        "latency": distribution([r["latency"] for r in ok]),
+        "time_to_first_log": distribution([r["first_log"] for r in ok if r["first_log"] is not None]),
+        "time_to_first_token": distribution([r["first_token"] for r in ok if r["first_token"] is not None]),
+        "event_loop": {
+            "probe_interval": lag_interval,
+            "lag": distribution(lag_samples),
+            "blocked_seconds": round(sum(blocked), 4),
+            "blocked_ratio": round(sum(blocked) / wall, 4) if wall else 0
+        }
+    }
+
+
+def git_version() -> str:
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=BENCH_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(old: Dict, new: Dict):
+    """打印与历史结果的对比：只比较数值型指标"""
+    def flatten(data, prefix=""):
+        for key, value in data.items():
+            name = f"{prefix}{key}"
+            if isinstance(value, dict):
+                yield from flatten(value, name + ".")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield name, value
+
+    old_values = dict(flatten(old["summary"]))
+    print(f"\n对比 {old.get('version')} ({old.get('timestamp')}) -> {new['version']}")
+    for name, value in flatten(new["summary"]):
+        before = old_values.get(name)
+        if before is None:
+            continue
+        delta = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"  {name:<36} {before:>10} -> {value:<10} {delta}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="热搜分析后端端到端基准测试（使用本地替身）")
+    parser.add_argument("--clients", type=int, default=4, help="并发客户端数")
+    parser.add_argument("--runs-per-client", type=int, default=3, help="每个客户端的运行次数")
+    parser.add_argument("--platforms", nargs="+", default=["weibo", "zhihu", "baidu", "douyin"])
+    parser.add_argument("--topics-per-platform", type=int, default=10)
+    parser.add_argument("--mode", choices=["single", "map_reduce"], default="single")
+    parser.add_argument("--no-dedupe", action="store_true")
+    parser.add_argument("--use-cache", action="store_true", help="启用热搜与分析缓存（默认关闭以测量完整流程）")
+    parser.add_argument("--coalesce", action="store_true", help="所有客户端发送相同请求，测量任务合并效果")
+    parser.add_argument("--analysis-concurrency", type=int, default=2, help="被测应用的 ANALYSIS_CONCURRENCY")
+    parser.add_argument("--request-timeout", type=float, default=600)
+    parser.add_argument("--lag-interval", type=float, default=0.01, help="事件循环探针间隔（秒）")
+    parser.add_argument("--fake-port", type=int, default=18080)
+    parser.add_argument("--app-port", type=int, default=18000)
+    parser.add_argument("--label", default="", help="结果文件名附加标签")
+    parser.add_argument("--compare", help="与之前保存的结果 JSON 对比")
+    add_profile_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+
+    # 被测应用在导入时读取环境变量，需先配置好
+    output_dir = tempfile.mkdtemp(prefix="hot_trends_bench_")
+    os.environ.update({
+        "OLLAMA_API": fake_url,
+        "HOT_SEARCH_API": f"{fake_url}/hot",
+        "OUTPUT_DIR": output_dir,
+        "ANALYSIS_CONCURRENCY": str(args.analysis_concurrency),
+        "SCHEDULE_INTERVAL": "0",
+    })
+    if not args.use_cache:
+        os.environ.update({"HOT_CACHE_TTL": "0", "HOT_CACHE_STALE_TTL": "0"})
+    sys.path.insert(0, APP_DIR)
+    import main as app_main
+
+    fake = ServerThread(create_app(profile_from_args(args)), args.fake_port)
+    app = ServerThread(app_main.app, args.app_port)
+    fake.start()
+    app.start()
+
+    stop_probe = threading.Event()
+    lag_samples: List[float] = []
+    probe = asyncio.run_coroutine_threadsafe(probe_loop_lag(args.lag_interval, stop_probe, lag_samples), app.loop)
+
+    try:
+        runs, wall = asyncio.run(drive(args, f"http://127.0.0.1:{args.app_port}"))
+    finally:
+        stop_probe.set()
+        probe.result(timeout=5)
+        app.stop()
+        fake.stop()
+
+    result = {
+        "version": git_version(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k != "compare"},
+        "summary": summarize(runs, wall, lag_samples, args.lag_interval),
+        "runs": runs
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d_%H%M%S')}_{result['version']}{'_' + args.label if args.label else ''}.json"
+    path = os.path.join(RESULTS_DIR, name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(json.dumps(result["summary"], ensure_ascii=False, indent=2))
+    print(f"\n💾 结果已保存至: {path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()